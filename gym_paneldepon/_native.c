@@ -0,0 +1,500 @@
+/*
+ * Native implementations of the deterministic parts of State.step.
+ *
+ * A board is 72 bits so it is kept in a 128 bit word. The functions read the
+ * bitboards of a State instance, operate on fixed width words and write the
+ * results back. They mirror the pure Python methods in state.py exactly.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#ifndef __SIZEOF_INT128__
+#error "A compiler with 128 bit integer support is required"
+#endif
+
+typedef unsigned __int128 board_t;
+
+#define WIDTH 6
+#define HEIGHT 12
+#define NUM_BLOCKS (WIDTH * HEIGHT)
+
+static board_t FULL;
+static board_t TOP;
+static board_t RIGHT_BLOCK;
+
+typedef struct {
+    Py_ssize_t height;
+    Py_ssize_t num_colors;
+    board_t *colors;
+    board_t falling;
+    board_t swapping;
+    board_t chaining;
+    long chain_number;
+} board_state;
+
+static board_t left(board_t panels) { return (panels & RIGHT_BLOCK) >> 1; }
+
+static board_t right(board_t panels) { return (panels << 1) & RIGHT_BLOCK; }
+
+static board_t up(board_t panels) { return panels >> WIDTH; }
+
+static board_t down(board_t panels) { return (panels << WIDTH) & FULL; }
+
+static int popcount(board_t panels)
+{
+    return __builtin_popcountll((unsigned long long)panels) +
+           __builtin_popcountll((unsigned long long)(panels >> 64));
+}
+
+static board_t get_matches(board_t panels)
+{
+    board_t residuals, horizontal_matches, vertical_matches;
+
+    residuals = panels & left(panels) & right(panels);
+    horizontal_matches = residuals | left(residuals) | right(residuals);
+
+    residuals = panels & up(panels) & down(panels);
+    vertical_matches = residuals | up(residuals) | down(residuals);
+
+    return horizontal_matches | vertical_matches;
+}
+
+static board_t empty_of(board_state *s)
+{
+    board_t empty = FULL;
+    Py_ssize_t i;
+    for (i = 0; i < s->num_colors; i++) {
+        empty ^= s->colors[i];
+    }
+    return empty;
+}
+
+/* Conversion between Python integers and boards. */
+
+static PyObject *SIXTY_FOUR;
+
+static int to_board(PyObject *obj, board_t *out)
+{
+    unsigned long long low, high;
+    PyObject *shifted;
+
+    low = PyLong_AsUnsignedLongLongMask(obj);
+    if (low == (unsigned long long)-1 && PyErr_Occurred()) {
+        return -1;
+    }
+    shifted = PyNumber_Rshift(obj, SIXTY_FOUR);
+    if (shifted == NULL) {
+        return -1;
+    }
+    high = PyLong_AsUnsignedLongLongMask(shifted);
+    Py_DECREF(shifted);
+    if (high == (unsigned long long)-1 && PyErr_Occurred()) {
+        return -1;
+    }
+    *out = ((board_t)high << 64) | low;
+    return 0;
+}
+
+static PyObject *from_board(board_t panels)
+{
+    PyObject *low, *high, *shifted, *result;
+    unsigned long long high_word = (unsigned long long)(panels >> 64);
+
+    low = PyLong_FromUnsignedLongLong((unsigned long long)panels);
+    if (low == NULL || high_word == 0) {
+        return low;
+    }
+    high = PyLong_FromUnsignedLongLong(high_word);
+    if (high == NULL) {
+        Py_DECREF(low);
+        return NULL;
+    }
+    shifted = PyNumber_Lshift(high, SIXTY_FOUR);
+    Py_DECREF(high);
+    if (shifted == NULL) {
+        Py_DECREF(low);
+        return NULL;
+    }
+    result = PyNumber_Or(shifted, low);
+    Py_DECREF(shifted);
+    Py_DECREF(low);
+    return result;
+}
+
+static int get_board_attr(PyObject *state, const char *name, board_t *out)
+{
+    int result;
+    PyObject *value = PyObject_GetAttrString(state, name);
+    if (value == NULL) {
+        return -1;
+    }
+    result = to_board(value, out);
+    Py_DECREF(value);
+    return result;
+}
+
+static int set_board_attr(PyObject *state, const char *name, board_t panels)
+{
+    int result;
+    PyObject *value = from_board(panels);
+    if (value == NULL) {
+        return -1;
+    }
+    result = PyObject_SetAttrString(state, name, value);
+    Py_DECREF(value);
+    return result;
+}
+
+static int get_size_attr(PyObject *state, const char *name, Py_ssize_t *out)
+{
+    PyObject *value = PyObject_GetAttrString(state, name);
+    if (value == NULL) {
+        return -1;
+    }
+    *out = PyNumber_AsSsize_t(value, PyExc_OverflowError);
+    Py_DECREF(value);
+    if (*out == -1 && PyErr_Occurred()) {
+        return -1;
+    }
+    return 0;
+}
+
+static void release(board_state *s)
+{
+    PyMem_Free(s->colors);
+    s->colors = NULL;
+}
+
+static int load(PyObject *state, board_state *s)
+{
+    PyObject *colors, *panels;
+    Py_ssize_t chain_number, i;
+
+    s->colors = NULL;
+    if (get_size_attr(state, "height", &s->height) < 0 ||
+        get_size_attr(state, "num_colors", &s->num_colors) < 0 ||
+        get_size_attr(state, "chain_number", &chain_number) < 0 ||
+        get_board_attr(state, "falling", &s->falling) < 0 ||
+        get_board_attr(state, "swapping", &s->swapping) < 0 ||
+        get_board_attr(state, "chaining", &s->chaining) < 0) {
+        return -1;
+    }
+    s->chain_number = (long)chain_number;
+    s->colors = PyMem_Malloc(sizeof(board_t) * (s->num_colors > 0 ? s->num_colors : 1));
+    if (s->colors == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    colors = PyObject_GetAttrString(state, "colors");
+    if (colors == NULL) {
+        release(s);
+        return -1;
+    }
+    for (i = 0; i < s->num_colors; i++) {
+        panels = PySequence_GetItem(colors, i);
+        if (panels == NULL || to_board(panels, &s->colors[i]) < 0) {
+            Py_XDECREF(panels);
+            Py_DECREF(colors);
+            release(s);
+            return -1;
+        }
+        Py_DECREF(panels);
+    }
+    Py_DECREF(colors);
+    return 0;
+}
+
+static int store(PyObject *state, board_state *s)
+{
+    PyObject *colors, *panels, *chain_number;
+    Py_ssize_t i;
+    int result = 0;
+
+    colors = PyObject_GetAttrString(state, "colors");
+    if (colors == NULL) {
+        return -1;
+    }
+    for (i = 0; i < s->num_colors && result == 0; i++) {
+        panels = from_board(s->colors[i]);
+        if (panels == NULL) {
+            result = -1;
+            break;
+        }
+        result = PySequence_SetItem(colors, i, panels);
+        Py_DECREF(panels);
+    }
+    Py_DECREF(colors);
+    if (result < 0) {
+        return -1;
+    }
+    chain_number = PyLong_FromLong(s->chain_number);
+    if (chain_number == NULL) {
+        return -1;
+    }
+    result = PyObject_SetAttrString(state, "chain_number", chain_number);
+    Py_DECREF(chain_number);
+    if (result < 0 ||
+        set_board_attr(state, "falling", s->falling) < 0 ||
+        set_board_attr(state, "swapping", s->swapping) < 0 ||
+        set_board_attr(state, "chaining", s->chaining) < 0) {
+        return -1;
+    }
+    return 0;
+}
+
+/* Game mechanics. See the corresponding methods of State. */
+
+static int swap(board_state *s, PyObject *index_obj)
+{
+    board_t protected, p, mask, swapping_left, swapping_right, swapping, c;
+    Py_ssize_t index, i;
+
+    protected = s->swapping & up(empty_of(s));
+    s->swapping = 0;
+    if (index_obj == Py_None) {
+        return 0;
+    }
+    index = PyNumber_AsSsize_t(index_obj, PyExc_OverflowError);
+    if (index == -1 && PyErr_Occurred()) {
+        return -1;
+    }
+    if (index % WIDTH == WIDTH - 1 || index >= s->height * WIDTH || index < 0) {
+        PyErr_SetString(PyExc_ValueError, "Cannot swap off screen");
+        return -1;
+    }
+    p = (board_t)1 << index;
+    mask = ~(p | right(p)) & FULL;
+    if (protected & ~mask) {
+        return 0;
+    }
+    for (i = 0; i < s->num_colors; i++) {
+        swapping_left = left(s->colors[i]) & p;
+        swapping_right = right(s->colors[i] & p);
+        swapping = swapping_left | swapping_right;
+        s->colors[i] &= mask;
+        s->colors[i] |= swapping;
+        s->swapping |= swapping;
+    }
+    c = s->chaining & s->falling;
+    s->chaining &= mask;
+    s->chaining |= (left(c) & p) | right(c & p);
+    /* Air support needed for lateslips */
+    if (s->swapping) {
+        s->swapping = ~mask & FULL;
+    }
+    return 0;
+}
+
+static void drop_one(board_state *s)
+{
+    board_t empty, row, protected, falling, panels;
+    Py_ssize_t i, j;
+
+    s->falling = 0;
+    empty = empty_of(s);
+    protected = s->swapping;
+    empty &= ~s->swapping; /* Air support needed for lateslips */
+    /* Nothing to do if no unprotected panel has an empty cell below it */
+    if (!(down(~empty_of(s) & FULL & ~protected) & empty & (((board_t)1 << (WIDTH * s->height)) - 1))) {
+        return;
+    }
+    row = TOP << (WIDTH * (s->height - 1));
+    for (i = 0; i < s->height - 1; i++) {
+        falling = down(s->chaining & ~protected) & row & empty;
+        s->chaining |= falling;
+        s->chaining ^= up(falling);
+        for (j = 0; j < s->num_colors; j++) {
+            panels = s->colors[j];
+            falling = down(panels & ~protected) & row & empty;
+            s->falling |= falling;
+            panels |= falling;
+            falling = up(falling);
+            panels ^= falling;
+            empty ^= falling;
+            s->colors[j] = panels;
+        }
+        row = up(row);
+    }
+}
+
+static PyObject *clear_matches(board_state *s)
+{
+    long score = 0;
+    int combo_size;
+    board_t chain_beam = 0, protected, panels = 0, matches;
+    Py_ssize_t i;
+
+    protected = s->falling | s->swapping;
+    for (i = 0; i < s->num_colors; i++) {
+        matches = get_matches(s->colors[i] & ~protected);
+        chain_beam |= matches;
+        s->colors[i] ^= matches;
+        panels |= s->colors[i];
+    }
+    combo_size = popcount(chain_beam);
+    if (s->chaining & chain_beam) {
+        s->chain_number += 1;
+    }
+    if (chain_beam) {
+        score = s->chain_number + 1;
+    }
+    chain_beam = up(chain_beam) & panels;
+    for (i = 0; i < s->height; i++) {
+        chain_beam |= up(chain_beam) & panels;
+    }
+    protected |= up(s->swapping);
+    s->chaining &= protected;
+    s->chaining |= panels & chain_beam;
+    if (!s->chaining) {
+        s->chain_number = 0;
+    }
+    return Py_BuildValue("(li)", score, combo_size);
+}
+
+/* Module interface */
+
+/* Stores the state while preserving a pending exception from a failed swap. */
+static void store_on_error(PyObject *state, board_state *s)
+{
+    PyObject *type, *value, *traceback;
+
+    PyErr_Fetch(&type, &value, &traceback);
+    if (store(state, s) < 0) {
+        PyErr_Clear();
+    }
+    PyErr_Restore(type, value, traceback);
+}
+
+static PyObject *native_swap(PyObject *self, PyObject *args)
+{
+    PyObject *state, *index;
+    board_state s;
+
+    if (!PyArg_ParseTuple(args, "OO:swap", &state, &index)) {
+        return NULL;
+    }
+    if (load(state, &s) < 0) {
+        return NULL;
+    }
+    if (swap(&s, index) < 0) {
+        store_on_error(state, &s);
+        release(&s);
+        return NULL;
+    }
+    if (store(state, &s) < 0) {
+        release(&s);
+        return NULL;
+    }
+    release(&s);
+    Py_RETURN_NONE;
+}
+
+static PyObject *native_drop_one(PyObject *self, PyObject *state)
+{
+    board_state s;
+
+    if (load(state, &s) < 0) {
+        return NULL;
+    }
+    drop_one(&s);
+    if (store(state, &s) < 0) {
+        release(&s);
+        return NULL;
+    }
+    release(&s);
+    Py_RETURN_NONE;
+}
+
+static PyObject *native_clear_matches(PyObject *self, PyObject *state)
+{
+    board_state s;
+    PyObject *result;
+
+    if (load(state, &s) < 0) {
+        return NULL;
+    }
+    result = clear_matches(&s);
+    if (result != NULL && store(state, &s) < 0) {
+        Py_CLEAR(result);
+    }
+    release(&s);
+    return result;
+}
+
+static PyObject *native_step(PyObject *self, PyObject *args)
+{
+    PyObject *state, *index, *result = NULL;
+    board_state s;
+
+    if (!PyArg_ParseTuple(args, "OO:step", &state, &index)) {
+        return NULL;
+    }
+    if (load(state, &s) < 0) {
+        return NULL;
+    }
+    if (swap(&s, index) < 0) {
+        store_on_error(state, &s);
+        release(&s);
+        return NULL;
+    }
+    drop_one(&s);
+    result = clear_matches(&s);
+    if (result != NULL && store(state, &s) < 0) {
+        Py_CLEAR(result);
+    }
+    release(&s);
+    return result;
+}
+
+static PyMethodDef native_methods[] = {
+    {"swap", native_swap, METH_VARARGS, "Swap the panels at index and its right neighbor"},
+    {"drop_one", native_drop_one, METH_O, "Drop unsupported panels by one row"},
+    {"clear_matches", native_clear_matches, METH_O, "Clear matching panels and return (chain, combo)"},
+    {"step", native_step, METH_VARARGS, "Swap, drop and clear matches. Returns (chain, combo)"},
+    {NULL, NULL, 0, NULL}
+};
+
+static int init_constants(void)
+{
+    int i;
+    board_t left_wall = 0;
+
+    FULL = ((board_t)1 << NUM_BLOCKS) - 1;
+    TOP = ((board_t)1 << WIDTH) - 1;
+    for (i = 0; i < NUM_BLOCKS; i += WIDTH) {
+        left_wall |= (board_t)1 << i;
+    }
+    RIGHT_BLOCK = FULL ^ left_wall;
+    SIXTY_FOUR = PyLong_FromLong(64);
+    return SIXTY_FOUR == NULL ? -1 : 0;
+}
+
+#if PY_MAJOR_VERSION >= 3
+
+static struct PyModuleDef native_module = {
+    PyModuleDef_HEAD_INIT,
+    "_native",
+    "Native implementations of the deterministic parts of State.step",
+    -1,
+    native_methods
+};
+
+PyMODINIT_FUNC PyInit__native(void)
+{
+    if (init_constants() < 0) {
+        return NULL;
+    }
+    return PyModule_Create(&native_module);
+}
+
+#else
+
+PyMODINIT_FUNC init_native(void)
+{
+    if (init_constants() < 0) {
+        return;
+    }
+    Py_InitModule3("_native", native_methods, "Native implementations of the deterministic parts of State.step");
+}
+
+#endif
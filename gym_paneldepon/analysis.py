@@ -0,0 +1,100 @@
+"""
+Static analysis of boards.
+
+The evaluator settles a state virtually on bare bitboards. Every tick the panels with a gap below them drop
+by one row and the panels at rest are matched, which is exactly what stepping the state without swapping does,
+but without cloning or stepping states.
+"""
+from collections import namedtuple
+
+from gym_paneldepon.bitboard import WIDTH, beam_up, compact, compaction_groups, down, get_matches, popcount, up
+
+# chain_number is the highest State.chain_number reached. It counts from 0 so a three link chain has chain number 2.
+# chain_length is the length of the longest chain counting every link, 1 for a lone match and 0 if nothing clears.
+# It is the largest reward the clears earn under the endless scoring method.
+# links lists the number of panels cleared on each tick that clears, whether or not the clear continues a chain.
+# settled is the final board as a State.
+ChainReport = namedtuple("ChainReport", ["chain_number", "chain_length", "links", "settled"])
+
+
+def board_mask(height):
+    return (1 << (WIDTH * height)) - 1
+
+
+def unsupported(occupied, height):
+    """Panels with an empty cell somewhere below them"""
+    return beam_up(board_mask(height) & ~occupied) & occupied
+
+
+def settle(colors, chaining, height):
+    """
+    Drops every panel as far as it goes. Chaining flags move along with their panels.
+    Returns the new colors and chaining panels.
+    Gaps of a single row are closed with one sweep. Deeper ones compact every column at once.
+    """
+    occupied = 0
+    for panels in colors:
+        occupied |= panels
+    chaining &= occupied
+    floating = unsupported(occupied, height)
+    if not floating:
+        return list(colors), chaining
+    if not unsupported((occupied & ~floating) | down(floating), height):
+        colors = [(panels & ~floating) | down(panels & floating) for panels in colors]
+        return colors, (chaining & ~floating) | down(chaining & floating)
+    groups = compaction_groups(occupied, height)
+    return [compact(panels, groups) for panels in colors], compact(chaining, groups)
+
+
+def evaluate(state):
+    """
+    Chain that the state produces without player input. The state itself is left untouched.
+    Equivalent to stepping the state without an action until nothing moves.
+    """
+    height = state.height
+    colors = state.colors[:]
+    chaining = state.chaining
+    chain_number = state.chain_number
+    best = chain_number
+    length = 0
+    links = []
+    occupied = 0
+    for panels in colors:
+        occupied |= panels
+    while True:
+        floating = unsupported(occupied, height)
+        falling = down(floating)
+        if floating:
+            for i, panels in enumerate(colors):
+                colors[i] = (panels & ~floating) | down(panels & floating)
+            chaining = (chaining & ~floating) | down(chaining & floating)
+            occupied = (occupied & ~floating) | falling
+        # Panels that moved during this tick can't match yet
+        cleared = 0
+        for panels in colors:
+            cleared |= get_matches(panels & ~falling)
+        if not floating and not cleared:
+            break
+        if cleared:
+            links.append(popcount(cleared))
+            occupied &= ~cleared
+            for i, panels in enumerate(colors):
+                colors[i] = panels & ~cleared
+            if chaining & cleared:
+                chain_number += 1
+                best = max(best, chain_number)
+            length = max(length, chain_number + 1)
+        # Panels resting on cleared ones will fall as part of the chain
+        beam = up(cleared) & occupied
+        for _ in range(height):
+            beam |= up(beam) & occupied
+        chaining = (chaining & falling) | beam
+        if not chaining:
+            chain_number = 0
+    settled = state.clone()
+    settled.colors = colors
+    settled.falling = 0
+    settled.swapping = 0
+    settled.chaining = 0
+    settled.chain_number = 0
+    return ChainReport(best, length, tuple(links), settled)
@@ -0,0 +1,349 @@
+import numpy as np
+from gym.utils import seeding
+
+from gym_paneldepon.bitboard import HALF_BLOCKS, HALF_FULL, HALF_HEIGHT, HEIGHT, RIGHT_BLOCK, TOP, WIDTH
+from gym_paneldepon.rows import sample_rows
+from gym_paneldepon.state import ACTIONS, NUM_COLORS, RAISE_STACK, State
+
+# A full board is 72 bits which doesn't fit a machine word so every bitboard is split
+# into two 36 bit halves: rows 0-5 live in word 0 and rows 6-11 in word 1.
+_ONE = np.uint64(1)
+_WIDTH = np.uint64(WIDTH)
+_CARRY = np.uint64(HALF_BLOCKS - WIDTH)
+_HALF_FULL = np.uint64(HALF_FULL)
+_RIGHT_BLOCK = np.uint64(RIGHT_BLOCK & HALF_FULL)
+_TOP = np.uint64(TOP)
+_BITS = np.arange(HALF_BLOCKS, dtype="uint64")
+
+RAISE_ACTION = ACTIONS.index(RAISE_STACK)
+# Maps action numbers to bit indices of the swap. Negative entries don't swap.
+SWAP_INDICES = np.array([-1, -1] + ACTIONS[2:])
+
+
+def split(panels):
+    return np.array([panels & HALF_FULL, panels >> HALF_BLOCKS], dtype="uint64")
+
+
+def join(halves):
+    return int(halves[0]) | (int(halves[1]) << HALF_BLOCKS)
+
+
+def left(panels):
+    return (panels & _RIGHT_BLOCK) >> _ONE
+
+
+def right(panels):
+    return (panels << _ONE) & _RIGHT_BLOCK
+
+
+def up(panels):
+    result = panels >> _WIDTH
+    result[..., 0] |= (panels[..., 1] & _TOP) << _CARRY
+    return result
+
+
+def down(panels):
+    result = (panels << _WIDTH) & _HALF_FULL
+    result[..., 1] |= panels[..., 0] >> _CARRY
+    return result
+
+
+def any_panels(panels):
+    return (panels[..., 0] | panels[..., 1]) != 0
+
+
+def popcount(panels):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(panels).sum(axis=-1, dtype="int64")
+    panels = panels - ((panels >> _ONE) & np.uint64(0x5555555555555555))
+    panels = (panels & np.uint64(0x3333333333333333)) + ((panels >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    panels = (panels + (panels >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    panels = (panels * np.uint64(0x0101010101010101)) >> np.uint64(56)
+    return (panels[..., 0] + panels[..., 1]).astype("int64")
+
+
+def get_matches(panels):
+    residuals = panels & left(panels) & right(panels)
+    horizontal_matches = residuals | left(residuals) | right(residuals)
+
+    residuals = panels & up(panels) & down(panels)
+    vertical_matches = residuals | up(residuals) | down(residuals)
+
+    return horizontal_matches | vertical_matches
+
+
+def row_mask(y):
+    mask = np.zeros(2, dtype="uint64")
+    mask[y // HALF_HEIGHT] = _TOP << np.uint64(WIDTH * (y % HALF_HEIGHT))
+    return mask
+
+
+def board_mask(height):
+    """Halves of the cells of a board of the given height"""
+    return split((1 << (WIDTH * height)) - 1)
+
+
+def decode_packed(planes, height, out=None, dtype="float"):
+    """Dense encoding of any number of packed encodings as produced by encode_packed"""
+    planes = np.asarray(planes, dtype="uint64")
+    shape = planes.shape[:-1]
+    bits = (planes[..., np.newaxis] >> _BITS) & _ONE
+    bits = bits.reshape(shape + (2 * HALF_BLOCKS,))[..., :height * WIDTH]
+    bits = bits.reshape(shape + (height, WIDTH))
+    if out is None:
+        return bits.astype(dtype)
+    out[...] = bits
+    return out
+
+
+class BatchState(object):
+    """
+    A batch of boards stepped in lockstep.
+    Each board follows the same rules as State but every operation is vectorized over the whole batch.
+    """
+
+    def __init__(self, batch_size, scoring_method=None, height=HEIGHT, num_colors=NUM_COLORS):
+        if height > HEIGHT:
+            raise ValueError("The maximum height is {}".format(HEIGHT))
+        self.batch_size = batch_size
+        self.scoring_method = scoring_method
+        self.height = height
+        self.num_colors = num_colors
+        self.reset()
+        self.seed()
+
+    def reset(self, indices=None):
+        if indices is None:
+            self.colors = np.zeros((self.num_colors, self.batch_size, 2), dtype="uint64")
+            self.falling = np.zeros((self.batch_size, 2), dtype="uint64")
+            self.swapping = np.zeros((self.batch_size, 2), dtype="uint64")
+            self.chaining = np.zeros((self.batch_size, 2), dtype="uint64")
+            self.chain_number = np.zeros(self.batch_size, dtype="int64")
+            return
+        self.colors[:, indices] = 0
+        self.falling[indices] = 0
+        self.swapping[indices] = 0
+        self.chaining[indices] = 0
+        self.chain_number[indices] = 0
+
+    @classmethod
+    def from_states(cls, states):
+        states = list(states)
+        if not states:
+            raise ValueError("At least one state required")
+        first = states[0]
+        for state in states:
+            if state.height != first.height or state.num_colors != first.num_colors:
+                raise ValueError("States must share height and number of colors")
+        instance = cls(len(states), scoring_method=first.scoring_method, height=first.height,
+                       num_colors=first.num_colors)
+        for i, state in enumerate(states):
+            instance.set_state(i, state)
+        return instance
+
+    def set_state(self, index, state):
+        for i, panels in enumerate(state.colors):
+            self.colors[i, index] = split(panels)
+        self.falling[index] = split(state.falling)
+        self.swapping[index] = split(state.swapping)
+        self.chaining[index] = split(state.chaining)
+        self.chain_number[index] = state.chain_number
+
+    def broadcast(self, state):
+        """Sets every board to the given state"""
+        for i, panels in enumerate(state.colors):
+            self.colors[i] = split(panels)
+        self.falling[:] = split(state.falling)
+        self.swapping[:] = split(state.swapping)
+        self.chaining[:] = split(state.chaining)
+        self.chain_number[:] = state.chain_number
+
+    def take(self, indices):
+        """New batch of copies of the given boards sharing the random number generator"""
+        other = object.__new__(self.__class__)
+        other.batch_size = len(indices)
+        other.scoring_method = self.scoring_method
+        other.height = self.height
+        other.num_colors = self.num_colors
+        other.colors = self.colors[:, indices]
+        other.falling = self.falling[indices]
+        other.swapping = self.swapping[indices]
+        other.chaining = self.chaining[indices]
+        other.chain_number = self.chain_number[indices]
+        other.np_random = self.np_random
+        return other
+
+    def put(self, indices, other):
+        """Copies the boards of another batch into the given boards"""
+        self.colors[:, indices] = other.colors
+        self.falling[indices] = other.falling
+        self.swapping[indices] = other.swapping
+        self.chaining[indices] = other.chaining
+        self.chain_number[indices] = other.chain_number
+
+    def get_state(self, index):
+        state = State(scoring_method=self.scoring_method, height=self.height, num_colors=self.num_colors)
+        state.colors = [join(panels[index]) for panels in self.colors]
+        state.falling = join(self.falling[index])
+        state.swapping = join(self.swapping[index])
+        state.chaining = join(self.chaining[index])
+        state.chain_number = int(self.chain_number[index])
+        return state
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return seed
+
+    @property
+    def empty(self):
+        empty = np.full((self.batch_size, 2), _HALF_FULL, dtype="uint64")
+        for panels in self.colors:
+            empty ^= panels
+        return empty
+
+    def swap(self, indices):
+        indices = np.asarray(indices)
+        protected = self.swapping & up(self.empty)
+        active = indices >= 0
+        if np.any(active & (indices % WIDTH == WIDTH - 1)):
+            raise ValueError("Cannot swap off screen")
+        if np.any(active & (indices >= self.height * WIDTH)):
+            raise ValueError("Cannot swap off screen")
+        p = np.zeros((self.batch_size, 2), dtype="uint64")
+        active_indices = np.flatnonzero(active)
+        bit_indices = indices[active_indices]
+        p[active_indices, bit_indices // HALF_BLOCKS] = _ONE << (bit_indices % HALF_BLOCKS).astype("uint64")
+        pair = p | right(p)
+        blocked = any_panels(protected & pair)
+        p[blocked] = 0
+        pair[blocked] = 0
+        mask = ~pair
+        swapping = np.zeros_like(p)
+        for panels in self.colors:
+            moved = (left(panels) & p) | right(panels & p)
+            panels &= mask
+            panels |= moved
+            swapping |= moved
+        c = self.chaining & self.falling
+        self.chaining &= mask
+        self.chaining |= (left(c) & p) | right(c & p)
+        # Air support needed for lateslips
+        self.swapping = pair * any_panels(swapping)[:, np.newaxis].astype("uint64")
+
+    def drop_one(self):
+        self.falling = np.zeros_like(self.falling)
+        empty = self.empty
+        protected = self.swapping
+        empty &= ~self.swapping  # Air support needed for lateslips
+        if not (down(~self.empty & _HALF_FULL & ~protected) & empty & board_mask(self.height)).any():
+            return
+        row = row_mask(self.height - 1)
+        for i in range(self.height - 1):
+            falling = down(self.chaining & ~protected) & row & empty
+            self.chaining |= falling
+            self.chaining ^= up(falling)
+            for panels in self.colors:
+                falling = down(panels & ~protected) & row & empty
+                self.falling |= falling
+                panels |= falling
+                falling = up(falling)
+                panels ^= falling
+                empty ^= falling
+            row = up(row)
+
+    def clear_matches(self):
+        chain_beam = np.zeros_like(self.chaining)
+        protected = self.falling | self.swapping
+        panels = np.zeros_like(self.chaining)
+        for colors in self.colors:
+            matches = get_matches(colors & ~protected)
+            chain_beam |= matches
+            colors ^= matches
+            panels |= colors
+        combo_size = popcount(chain_beam)
+        self.chain_number += any_panels(self.chaining & chain_beam)
+        score = np.where(any_panels(chain_beam), self.chain_number + 1, 0)
+        chain_beam = up(chain_beam) & panels
+        if chain_beam.any():
+            for i in range(self.height):
+                chain_beam |= up(chain_beam) & panels
+        protected |= up(self.swapping)
+        self.chaining &= protected
+        self.chaining |= panels & chain_beam
+        self.chain_number[~any_panels(self.chaining)] = 0
+        return score, combo_size
+
+    def _row_planes(self, rows):
+        """Bitboard halves of freshly inserted rows, one plane per color"""
+        planes = np.zeros((self.num_colors, len(rows), 2), dtype="uint64")
+        word = (self.height - 1) // HALF_HEIGHT
+        shift = np.uint64(WIDTH * ((self.height - 1) % HALF_HEIGHT))
+        weights = _ONE << np.arange(WIDTH, dtype="uint64")
+        for i in range(self.num_colors):
+            planes[i, :, word] = ((rows == i) * weights).sum(axis=1).astype("uint64") << shift
+        return planes
+
+    def _forbidden_colors(self, indices):
+        """Forbidden colors of new rows for the given boards. See rows.forbidden_colors."""
+        forbidden = np.full((len(indices), WIDTH), -1, dtype="int64")
+        if self.height < 3:
+            return forbidden
+        protected = self.falling[indices] | self.swapping[indices]
+        word = (self.height - 1) // HALF_HEIGHT
+        shift = np.uint64(WIDTH * ((self.height - 1) % HALF_HEIGHT))
+        columns = np.arange(WIDTH, dtype="uint64")
+        for i in range(self.num_colors):
+            panels = self.colors[i, indices] & ~protected
+            pairs = ((panels & down(panels))[:, word] >> shift) & _TOP
+            forbidden[((pairs[:, np.newaxis] >> columns) & _ONE).astype(bool)] = i
+        return forbidden
+
+    def _insert_rows(self, indices, rows):
+        planes = self._row_planes(rows)
+        self.falling[indices] = up(self.falling[indices])
+        self.chaining[indices] = up(self.chaining[indices])
+        self.swapping[indices] = up(self.swapping[indices])
+        for i in range(self.num_colors):
+            self.colors[i, indices] = up(self.colors[i, indices]) | planes[i]
+
+    def raise_stack(self, mask=None):
+        topped = np.zeros(self.batch_size, dtype=bool)
+        for panels in self.colors:
+            topped |= (panels[:, 0] & _TOP) != 0
+        if mask is not None:
+            topped |= ~np.asarray(mask, dtype=bool)
+        indices = np.flatnonzero(~topped)
+        if not len(indices):
+            return
+        rows = sample_rows(self.np_random, self._forbidden_colors(indices), self.num_colors)
+        self._insert_rows(indices, rows)
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        raising = actions == RAISE_ACTION
+        self.swap(SWAP_INDICES[actions])
+        self.drop_one()
+        result = self.clear_matches()
+        if raising.any():
+            self.raise_stack(raising)
+        return self.calculate_score(result)
+
+    def encode_packed(self, out=None):
+        """Packed encoding of every board in the same layout as State.encode_packed"""
+        if out is None:
+            out = np.empty((self.batch_size, self.num_colors + 3, 2), dtype="uint64")
+        out[:, :self.num_colors] = self.colors.swapaxes(0, 1)
+        out[:, -3] = self.falling
+        out[:, -2] = self.chaining
+        out[:, -1] = self.swapping
+        return out
+
+    def encode(self, out=None, dtype="float"):
+        return decode_packed(self.encode_packed(), self.height, out=out, dtype=dtype)
+
+    def calculate_score(self, result):
+        if self.scoring_method is None:
+            return result
+        chain, combo = result
+        if self.scoring_method == "endless":
+            return np.where(chain, chain, np.where(combo, self.chain_number, 0))
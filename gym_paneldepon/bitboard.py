@@ -1,5 +1,7 @@
 import sys
 
+import numpy as np
+
 WIDTH = 6
 HEIGHT = 12
 NUM_BLOCKS = WIDTH * HEIGHT
@@ -13,6 +15,29 @@ LEFT_WALL = sum(1 << i for i in range(0, NUM_BLOCKS, WIDTH))
 RIGHT_BLOCK = FULL ^ LEFT_WALL
 RIGHT_WALL = LEFT_WALL << (WIDTH - 1)
 
+# Boards split into two machine words of 36 bits each
+HALF_HEIGHT = HEIGHT // 2
+HALF_BLOCKS = WIDTH * HALF_HEIGHT
+HALF_FULL = FULL >> HALF_BLOCKS
+
+BYTE_POPCOUNTS = [bin(i).count("1") for i in range(256)]
+ROW_LISTS = [[bool(row & (1 << i)) for i in range(WIDTH)] for row in range(1 << WIDTH)]
+ROW_TABLE = np.array(ROW_LISTS, dtype="float")
+_ROW_TABLES = {ROW_TABLE.dtype: ROW_TABLE}
+_ROW_SHIFTS = np.arange(0, HALF_BLOCKS, WIDTH, dtype="uint64")
+
+# Column-major layout. Column x is a lane of HEIGHT bits starting at bit x * HEIGHT with the top row in the lowest bit.
+LANE = (1 << HEIGHT) - 1
+_ROW_TO_LANES = [sum(1 << (x * HEIGHT) for x in range(WIDTH) if row & (1 << x)) for row in range(1 << WIDTH)]
+_LANE_TO_ROWS = [0]
+for _y in range(HEIGHT):
+    _LANE_TO_ROWS += [rows | (1 << (_y * WIDTH)) for rows in _LANE_TO_ROWS]
+# Cells below boards of each height, treated as occupied when compacting columns
+_BOARD_FLOORS = [
+    sum((LANE ^ ((1 << height) - 1)) << (x * HEIGHT) for x in range(WIDTH)) for height in range(HEIGHT + 1)
+]
+_lane_groups = None
+
 
 def print_panels(panels, outfile=sys.stdout):
     for i in range(HEIGHT):
@@ -26,7 +51,35 @@ def print_panels(panels, outfile=sys.stdout):
 
 
 def panels_to_list(panels):
-    return [bool(panels & (1 << i)) for i in range(WIDTH * HEIGHT)]
+    result = []
+    for i in range(HEIGHT):
+        result.extend(ROW_LISTS[(panels >> (i * WIDTH)) & TOP])
+    return result
+
+
+def row_table(dtype="float"):
+    """ROW_TABLE converted to the given dtype"""
+    dtype = np.dtype(dtype)
+    if dtype not in _ROW_TABLES:
+        _ROW_TABLES[dtype] = ROW_TABLE.astype(dtype)
+    return _ROW_TABLES[dtype]
+
+
+def panels_to_halves(features, out=None):
+    """Packs each feature into two uint64 words of 36 bits each"""
+    if out is None:
+        out = np.empty((len(features), 2), dtype="uint64")
+    for i, panels in enumerate(features):
+        out[i, 0] = panels & HALF_FULL
+        out[i, 1] = panels >> HALF_BLOCKS
+    return out
+
+
+def panels_to_rows(features, height=HEIGHT):
+    """Array of row bit patterns for each feature usable as indices to ROW_TABLE"""
+    halves = panels_to_halves(features)
+    rows = (halves[:, :, np.newaxis] >> _ROW_SHIFTS) & np.uint64(TOP)
+    return rows.reshape(len(features), HEIGHT)[:, :height]
 
 
 def panels_from_list(stack):
@@ -67,8 +120,16 @@ def beam_up(panels):
     return panels
 
 
-def popcount(panels):
-    return sum(bool(panels & (1 << i)) for i in range(WIDTH * HEIGHT))
+if hasattr(int, "bit_count"):
+    def popcount(panels):
+        return panels.bit_count()
+else:  # pragma: no cover
+    def popcount(panels):
+        count = 0
+        while panels:
+            count += BYTE_POPCOUNTS[panels & 255]
+            panels >>= 8
+        return count
 
 
 def get_matches(panels):
@@ -79,3 +140,73 @@ def get_matches(panels):
     vertical_matches = residuals | up(residuals) | down(residuals)
 
     return horizontal_matches | vertical_matches
+
+
+def to_columns(panels):
+    """Converts a bitboard into the column-major layout"""
+    columns = 0
+    y = 0
+    while panels:
+        columns |= _ROW_TO_LANES[panels & TOP] << y
+        panels >>= WIDTH
+        y += 1
+    return columns
+
+
+def from_columns(columns):
+    """Converts a bitboard from the column-major layout"""
+    panels = 0
+    for x in range(WIDTH):
+        panels |= _LANE_TO_ROWS[(columns >> (x * HEIGHT)) & LANE] << x
+    return panels
+
+
+def lane_groups():
+    """
+    Table indexed by the occupancy of a column lane. Each entry lists (distance, panels) pairs grouping the panels
+    that fall the same distance when the column is compacted to the bottom. Panels are given in the row-major
+    layout for the leftmost column.
+    """
+    global _lane_groups
+    if _lane_groups is None:
+        _lane_groups = []
+        for lane in range(1 << HEIGHT):
+            groups = {}
+            distance = 0
+            for y in range(HEIGHT - 1, -1, -1):
+                if lane & (1 << y):
+                    if distance:
+                        groups[distance] = groups.get(distance, 0) | (1 << (y * WIDTH))
+                else:
+                    distance += 1
+            _lane_groups.append(tuple(sorted(groups.items())))
+    return _lane_groups
+
+
+def compaction_groups(occupied, height=HEIGHT):
+    """
+    Groups of panels that fall the same number of rows when every column is compacted to the bottom of the board.
+    Returns (rows, panels) pairs sorted by distance. Panels not in any group stay in place.
+    """
+    table = lane_groups()
+    columns = to_columns(occupied) | _BOARD_FLOORS[height]
+    groups = {}
+    for x in range(WIDTH):
+        entry = table[(columns >> (x * HEIGHT)) & LANE]
+        if not entry:
+            continue
+        for distance, panels in entry:
+            if distance in groups:
+                groups[distance] |= panels << x
+            else:
+                groups[distance] = panels << x
+    # Shortest distances first so that every panel lands on a cell that has already been vacated
+    return sorted(groups.items())
+
+
+def compact(panels, groups):
+    """Moves panels according to compaction_groups"""
+    for distance, group in groups:
+        moving = panels & group
+        panels = (panels ^ moving) | (moving << (distance * WIDTH))
+    return panels
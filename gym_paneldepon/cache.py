@@ -0,0 +1,69 @@
+import sys
+from collections import OrderedDict
+
+from gym_paneldepon.state import RAISE_STACK
+
+
+class StepCache(object):
+    """
+    Memoizes the deterministic transitions of State.step with least recently used eviction.
+    Entries are evicted once there are more than max_entries of them or
+    their estimated size exceeds max_bytes.
+    RAISE_STACK is random and never cached.
+    """
+
+    def __init__(self, max_entries=65536, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.size,
+        }
+
+    def step(self, state, action):
+        """Steps the state in place like State.step"""
+        if action is RAISE_STACK:
+            return state.step(action)
+        key = (state.key, state.scoring_method, action)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            score = state.step(action)
+            entry = (tuple(state.colors), state.falling, state.swapping, state.chaining, state.chain_number, score)
+            self.size += self._sizeof(key, entry)
+            self.entries[key] = entry
+            self._evict()
+            return score
+        self.hits += 1
+        self.entries[key] = entry
+        colors, state.falling, state.swapping, state.chaining, state.chain_number, score = entry
+        state.colors = list(colors)
+        return score
+
+    def _sizeof(self, key, entry):
+        size = sys.getsizeof(key) + sys.getsizeof(key[0]) + sys.getsizeof(entry)
+        for value in entry[0] + entry[1:]:
+            size += sys.getsizeof(value)
+        return size
+
+    def _evict(self):
+        while self.entries and (
+                len(self.entries) > self.max_entries or
+                (self.max_bytes is not None and self.size > self.max_bytes)):
+            key, entry = self.entries.popitem(last=False)
+            self.size -= self._sizeof(key, entry)
@@ -0,0 +1,98 @@
+"""
+Thin asyncio client of the environment server. Requires Python 3.5 or later.
+"""
+import asyncio
+
+from gym_paneldepon.protocol import (
+    CLOSE, CONFIG, CREATE, ERROR, REQUEST, RESET, RESPONSE, STEP, TREE, ServerError, decode_step, decode_tree
+)
+
+
+class BaseClient(object):
+    """
+    Client side of the protocol. Subclasses implement _send which returns the status and payload of a request.
+    Every environment hosted by a server shares its height and number of colors which are learned by create.
+    """
+
+    def __init__(self):
+        self.num_colors = None
+        self.num_actions = None
+        self.height = None
+
+    async def _send(self, opcode, env_id, argument):
+        raise NotImplementedError
+
+    async def _call(self, opcode, env_id=0, argument=0):
+        status, payload = await self._send(opcode, env_id, argument)
+        if status == ERROR:
+            raise ServerError(payload.decode("utf-8"))
+        return payload
+
+    async def create(self):
+        """Creates a new environment and returns its id"""
+        payload = await self._call(CREATE)
+        env_id, self.height, self.num_colors, self.num_actions = CONFIG.unpack(payload)
+        return env_id
+
+    async def reset(self, env_id):
+        """Returns the initial observation"""
+        observation, _ = decode_step(await self._call(RESET, env_id), self.num_colors)
+        return observation
+
+    async def step(self, env_id, action):
+        """Returns the observation and the reward"""
+        return decode_step(await self._call(STEP, env_id, action), self.num_colors)
+
+    async def get_tree(self, env_id):
+        """Chain numbers, observations, rewards and the action mask of every child. See PdPEndlessEnv.get_tree_batch."""
+        return decode_tree(await self._call(TREE, env_id), self.num_colors, self.num_actions)
+
+    async def close_env(self, env_id):
+        await self._call(CLOSE, env_id)
+
+
+class Client(BaseClient):
+    """Client connected to a server over a Unix socket or TCP. Requests may be issued concurrently."""
+
+    def __init__(self, reader, writer):
+        super(Client, self).__init__()
+        self.reader = reader
+        self.writer = writer
+        self.futures = {}
+        self.next_id = 0
+        self.receiver = asyncio.ensure_future(self._receive())
+
+    @classmethod
+    async def connect(cls, path=None, host="127.0.0.1", port=None):
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def _receive(self):
+        try:
+            while True:
+                header = await self.reader.readexactly(RESPONSE.size)
+                request_id, status, size = RESPONSE.unpack(header)
+                payload = await self.reader.readexactly(size)
+                self.futures.pop(request_id).set_result((status, payload))
+        except (asyncio.IncompleteReadError, ConnectionError) as error:
+            for future in self.futures.values():
+                future.set_exception(ConnectionError(str(error)))
+            self.futures.clear()
+
+    async def _send(self, opcode, env_id, argument):
+        request_id = self.next_id
+        self.next_id = (self.next_id + 1) & 0xffffffff
+        future = asyncio.get_event_loop().create_future()
+        self.futures[request_id] = future
+        self.writer.write(REQUEST.pack(request_id, opcode, env_id, argument))
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.receiver
+        except asyncio.CancelledError:  # pragma: no cover
+            pass
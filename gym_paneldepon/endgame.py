@@ -0,0 +1,223 @@
+"""
+Endgame tables for small boards.
+
+A table holds the best reward reachable within k moves for k = 1 ... depth for every position it covers.
+Only the deterministic actions are considered so raising the stack is left out.
+Positions are keyed by a 64 bit hash of the smaller of the keys of the state and its mirror image
+as the rules are symmetric under mirroring.
+
+Even PdPEndless4-v0 has far too many positions to enumerate them all so tables are solved from a set of roots,
+such as random raised stacks, under a position budget. Positions first reached with r moves to spare have
+exact values only up to k = r. The missing values are stored as UNKNOWN.
+
+The table file is an open addressing hash table with linear probing that is read through a memory map.
+"""
+import os
+import struct
+
+import numpy as np
+
+from gym_paneldepon.bitboard import HEIGHT, TOP, WIDTH
+from gym_paneldepon.state import ACTIONS, RAISE_STACK, State
+
+MAGIC = b"PDPENDG1"
+HEADER = struct.Struct("<8sHHHxxQQ")
+HEADER_SIZE = 32
+UNKNOWN = 255
+EMPTY_KEY = 0
+
+_MASK64 = (1 << 64) - 1
+_REVERSED_ROWS = [int("{:06b}".format(row)[::-1], 2) for row in range(1 << WIDTH)]
+
+
+def mirror_panels(panels, height=HEIGHT):
+    result = 0
+    for y in range(height):
+        result |= _REVERSED_ROWS[(panels >> (WIDTH * y)) & TOP] << (WIDTH * y)
+    return result
+
+
+def mirror(state):
+    """Copy of the state flipped horizontally"""
+    other = state.clone()
+    other.colors = [mirror_panels(panels, state.height) for panels in state.colors]
+    other.falling = mirror_panels(state.falling, state.height)
+    other.swapping = mirror_panels(state.swapping, state.height)
+    other.chaining = mirror_panels(state.chaining, state.height)
+    return other
+
+
+def _mix(key):
+    result = 0x9e3779b97f4a7c15
+    while True:
+        result ^= key & _MASK64
+        result = (result * 0xbf58476d1ce4e5b9) & _MASK64
+        result ^= result >> 31
+        key >>= 64
+        if not key:
+            break
+    result = (result * 0x94d049bb133111eb) & _MASK64
+    result ^= result >> 29
+    return result or 1
+
+
+def canonical_hash(state):
+    """Nonzero 64 bit hash shared by the state and its mirror image"""
+    return _mix(min(state.key, mirror(state).key))
+
+
+def _children(state):
+    result = []
+    mask = state.get_action_mask()
+    for action, allowed in zip(ACTIONS, mask):
+        if action is RAISE_STACK or not allowed:
+            continue
+        child = state.clone()
+        result.append((child.step(action), child))
+    return result
+
+
+class Solver(object):
+    """
+    Memoized depth limited search. values[key][k - 1] is the best reward reachable within k moves.
+    Transpositions and mirror images are merged using canonical_hash.
+    """
+
+    def __init__(self, max_reward=UNKNOWN - 1):
+        self.max_reward = max_reward
+        self.values = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def solve(self, state, depth):
+        """Values of the state up to depth moves"""
+        if depth <= 0:
+            return []
+        key = canonical_hash(state)
+        values = self.values.get(key)
+        if values is not None and len(values) >= depth:
+            return values
+        children = [(reward, self.solve(child, depth - 1)) for reward, child in _children(state)]
+        values = []
+        for k in range(depth):
+            best = 0
+            for reward, child_values in children:
+                best = max(best, reward, child_values[k - 1] if k else 0)
+            values.append(min(best, self.max_reward))
+        self.values[key] = values
+        return values
+
+    def items(self):
+        """(key, values) pairs of every position solved"""
+        return self.values.items()
+
+
+def solve(roots, depth, max_positions=1000000):
+    """
+    Solves the roots in order until the position budget is exceeded.
+    Returns the solver and the number of roots that were solved.
+    """
+    solver = Solver()
+    solved = 0
+    for root in roots:
+        if len(solver) >= max_positions:
+            break
+        root = root.clone()
+        root.scoring_method = "endless"
+        solver.solve(root, depth)
+        solved += 1
+    return solver, solved
+
+
+def random_roots(num_roots, height=4, num_colors=3, seed=0):
+    """Settled stacks of random height raised from an empty board"""
+    np_random = np.random.RandomState(seed)
+    roots = []
+    for _ in range(num_roots):
+        state = State(scoring_method="endless", height=height, num_colors=num_colors)
+        state.seed(int(np_random.randint(0, 2 ** 31)))
+        for _ in range(np_random.randint(1, height)):
+            state.raise_stack()
+        roots.append(state)
+    return roots
+
+
+def record_dtype(depth):
+    return np.dtype([("key", "<u8"), ("values", "u1", (depth,))])
+
+
+def _capacity(size, load_factor):
+    capacity = 1
+    while capacity * load_factor < size:
+        capacity <<= 1
+    return capacity
+
+
+def write_table(path, solver, depth, height, num_colors, load_factor=0.5):
+    """Writes the values of the solved positions up to depth to a table file"""
+    capacity = _capacity(len(solver), load_factor)
+    records = np.zeros(capacity, dtype=record_dtype(depth))
+    keys = records["key"]
+    table_values = records["values"]
+    table_values[:] = UNKNOWN
+    for key, values in solver.items():
+        index = key & (capacity - 1)
+        while keys[index]:
+            index = (index + 1) & (capacity - 1)
+        keys[index] = key
+        values = values[:depth]
+        table_values[index, :len(values)] = values
+    with open(path, "wb") as outfile:
+        header = HEADER.pack(MAGIC, depth, height, num_colors, capacity, len(solver))
+        outfile.write(header.ljust(HEADER_SIZE, b"\0"))
+        outfile.write(records.tobytes())
+
+
+def build_table(path, roots, depth, max_positions=1000000, load_factor=0.5):
+    """Solves the roots and writes the table. Returns the number of roots solved."""
+    roots = list(roots)
+    solver, solved = solve(roots, depth, max_positions)
+    write_table(path, solver, depth, roots[0].height, roots[0].num_colors, load_factor)
+    return solved
+
+
+class EndgameTable(object):
+    """Memory-mapped table file. Lookups probe a handful of records."""
+
+    def __init__(self, path):
+        with open(path, "rb") as infile:
+            header = infile.read(HEADER_SIZE)
+        magic, self.depth, self.height, self.num_colors, self.capacity, self.size = HEADER.unpack_from(header)
+        if magic != MAGIC:
+            raise ValueError("Not an endgame table")
+        if os.path.getsize(path) != HEADER_SIZE + self.capacity * record_dtype(self.depth).itemsize:
+            raise ValueError("Truncated endgame table")
+        self.records = np.memmap(
+            path, dtype=record_dtype(self.depth), mode="r", offset=HEADER_SIZE, shape=(self.capacity,)
+        )
+
+    def __len__(self):
+        return self.size
+
+    def lookup(self, state):
+        """Values of the state for k = 1 ... depth or None if the state isn't in the table"""
+        if state.height != self.height or state.num_colors != self.num_colors:
+            return None
+        key = canonical_hash(state)
+        index = key & (self.capacity - 1)
+        while True:
+            record = self.records[index]
+            stored = int(record["key"])
+            if stored == key:
+                return record["values"]
+            if stored == EMPTY_KEY:
+                return None
+            index = (index + 1) & (self.capacity - 1)
+
+    def value(self, state, k):
+        """Best reward reachable within k moves or None if unknown"""
+        values = self.lookup(state)
+        if values is None or not 1 <= k <= self.depth or values[k - 1] == UNKNOWN:
+            return None
+        return int(values[k - 1])
@@ -1,4 +1,5 @@
 import sys
+from collections import namedtuple
 
 import gym
 import gym.envs.registration
@@ -6,37 +7,103 @@ from gym import spaces
 import numpy as np  # noqa: I001
 from six import StringIO
 
-from gym_paneldepon.bitboard import HEIGHT, WIDTH
-from gym_paneldepon.state import ACTIONS, NUM_COLORS, State
+from gym_paneldepon.batch import RAISE_ACTION, BatchState
+from gym_paneldepon.bitboard import HALF_FULL, HEIGHT, WIDTH
+from gym_paneldepon.profiling import Profiler
+from gym_paneldepon.render import render_batch
+from gym_paneldepon.state import ACTIONS, NUM_COLORS, RAISE_STACK, State
 
 MAX_CHAIN = 13
 
+# Dense encodings by dtype and the packed encoding of State.encode_packed
+ENCODINGS = ("float", "float32", "uint8", "bool", "packed")
+
+
+def observation_shape(encoding, num_colors, height):
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown encoding {}".format(encoding))
+    if encoding == "packed":
+        return (num_colors + 3, 2)
+    return (num_colors + 3, height, WIDTH)
+
+
+# One-ply expansion of every action. mask is the action mask of the root or None if it wasn't requested.
+TreeBatch = namedtuple("TreeBatch", ["chain_numbers", "observations", "rewards", "mask"])
+
+# Unique nodes of a search tree. Node 0 is the root.
+# children[i, a] is the node reached from node i with action a or -1 if node i wasn't expanded.
+# rewards[i, a] is the reward of that edge.
+GameTree = namedtuple("GameTree", ["chain_numbers", "observations", "children", "rewards"])
+
+
+def empty_observations(size, encoding, num_colors, height):
+    shape = (size,) + observation_shape(encoding, num_colors, height)
+    return np.zeros(shape, dtype="uint64" if encoding == "packed" else encoding)
+
+
+def observation_box(encoding, num_colors, height):
+    # The Box of gym 0.9.4 has no dtype so the one of the encoding isn't part of the space
+    shape = observation_shape(encoding, num_colors, height)
+    if encoding == "packed":
+        return spaces.Box(0, HALF_FULL, shape)
+    return spaces.Box(0, 1, shape)
+
 
 class PdPEndlessEnv(gym.Env):
     """
     Panel de Pon environment. Single player endless mode.
+    Observations are encoded densely with the dtype given by encoding or packed into uint64 words if it is "packed".
+    The observation space only bounds the values since gym 0.9.4 can't represent uint8, bool or uint64 Boxes.
+    get_tree clones the state for every action. Use get_tree_batch to expand the actions into reused buffers.
+    If cache is a StepCache the deterministic transitions of steps and tree expansions are memoized in it.
     """
 
     metadata = {"render.modes": ["human", "ansi"]}
 
-    def __init__(self, height=HEIGHT, num_colors=NUM_COLORS, max_chain=MAX_CHAIN):
+    def __init__(self, height=HEIGHT, num_colors=NUM_COLORS, max_chain=MAX_CHAIN, encoding="float", cache=None):
         self.state = State(scoring_method="endless", height=height, num_colors=num_colors)
         self.max_chain = max_chain
+        self.encoding = encoding
+        self.cache = cache
         self.reward_range = (0, self.max_chain)
         self.action_space = spaces.Discrete((WIDTH - 1) * self.state.height + 2)
         self.observation_space = spaces.Tuple((
             spaces.Discrete(self.max_chain),
-            spaces.Box(0, 1, (self.state.num_colors + 3, self.state.height, WIDTH)),
+            observation_box(encoding, self.state.num_colors, self.state.height),
         ))
+        self._tree_batch = None
         self._seed()
 
     def _seed(self, seed=None):
         seed = self.state.seed(seed)
         return [seed]
 
+    def encode(self, state, out=None):
+        profiler = state.profiler
+        if profiler is not None:
+            start = profiler.timer()
+        if self.encoding == "packed":
+            result = state.encode_packed(out=out)
+        else:
+            result = state.encode(out=out, dtype=self.encoding)
+        if profiler is not None:
+            profiler.add("encode", profiler.timer() - start)
+        return result
+
+    def enable_profiling(self, enabled=True):
+        """Attaches a fresh Profiler to the state or removes it. Returns the profiler."""
+        self.state.profiler = Profiler() if enabled else None
+        return self.state.profiler
+
+    def get_profile(self):
+        """Profiling counters as a dict or None if profiling is disabled"""
+        if self.state.profiler is None:
+            return None
+        return self.state.profiler.as_dict()
+
     def _reset(self):
         self.state.reset()
-        return (self.state.chain_number, self.state.encode())
+        return (self.state.chain_number, self.encode(self.state))
 
     def _render(self, mode="human", close=False):
         if close:
@@ -45,13 +112,16 @@ class PdPEndlessEnv(gym.Env):
         self.state.render(outfile)
         return outfile
 
-    def _step_state(self, state, action, include_observations=True):
+    def _step_state(self, state, action, include_observations=True, out=None):
         action = ACTIONS[action]
-        score = state.step(action)
+        if self.cache is None:
+            score = state.step(action)
+        else:
+            score = self.cache.step(state, action)
         reward = min(score, self.max_chain)
         chain_number = min(state.chain_number, self.max_chain - 1)
         if include_observations:
-            observation = (chain_number, state.encode())
+            observation = (chain_number, self.encode(state, out=out))
             return observation, reward
         return reward
 
@@ -64,19 +134,175 @@ class PdPEndlessEnv(gym.Env):
         if depth != 1:
             raise NotImplementedError("Only depth 1 trees supported")
         results = []
+        if include_observations:
+            observations = empty_observations(
+                self.action_space.n, self.encoding, self.state.num_colors, self.state.height
+            )
         for i in range(self.action_space.n):
             clone = self.state.clone()
-            results.append(self._step_state(clone, i, include_observations=include_observations))
+            if include_observations:
+                results.append(self._step_state(clone, i, out=observations[i]))
+            else:
+                results.append(self._step_state(clone, i, include_observations=False))
         if include_observations:
             return results
         return np.array(results, dtype="float")
 
+    def get_tree_batch(self, include_mask=True):
+        """
+        Expands every action of the current state at once.
+        Returns a TreeBatch of arrays indexed by action. The arrays are reused and overwritten by the next call.
+        """
+        if self._tree_batch is None or self._tree_batch[0].height != self.state.height:
+            n = self.action_space.n
+            self._tree_batch = (
+                BatchState(n, scoring_method="endless", height=self.state.height, num_colors=self.state.num_colors),
+                TreeBatch(
+                    np.zeros(n, dtype="int64"),
+                    empty_observations(n, self.encoding, self.state.num_colors, self.state.height),
+                    np.zeros(n),
+                    np.zeros(n, dtype=bool),
+                ),
+                # Raising the stack is stepped separately as sampling a single row is faster unvectorized
+                np.where(np.arange(n) == RAISE_ACTION, 0, np.arange(n)),
+            )
+        batch, buffers, actions = self._tree_batch
+        batch.broadcast(self.state)
+        scores = batch.step(actions)
+        raised = self.state.clone()
+        raised.np_random = batch.np_random
+        scores[RAISE_ACTION] = raised.step(RAISE_STACK)
+        batch.set_state(RAISE_ACTION, raised)
+        np.minimum(scores, self.max_chain, out=buffers.rewards)
+        np.minimum(batch.chain_number, self.max_chain - 1, out=buffers.chain_numbers)
+        if self.encoding == "packed":
+            batch.encode_packed(out=buffers.observations)
+        else:
+            batch.encode(out=buffers.observations)
+        if not include_mask:
+            return buffers._replace(mask=None)
+        buffers.mask[:] = self.state.get_action_mask()
+        return buffers
+
+    def get_game_tree(self, depth, include_observations=True):
+        """
+        Expands every action up to a search depth.
+        Returns a GameTree where identical states are merged into a single node.
+        """
+        if depth < 1:
+            raise ValueError("Depth must be positive")
+        root = self.state.clone()
+        nodes = [root]
+        table = {root.key: 0}
+        children = []
+        rewards = []
+        level = [0]
+        for _ in range(depth):
+            next_level = []
+            for index in level:
+                node_children = np.full(self.action_space.n, -1, dtype="int64")
+                node_rewards = np.zeros(self.action_space.n)
+                for action in range(self.action_space.n):
+                    child = nodes[index].clone()
+                    node_rewards[action] = self._step_state(child, action, include_observations=False)
+                    key = child.key
+                    if key not in table:
+                        table[key] = len(nodes)
+                        nodes.append(child)
+                        next_level.append(table[key])
+                    node_children[action] = table[key]
+                # Nodes are expanded in the order they were discovered
+                children.append(node_children)
+                rewards.append(node_rewards)
+            level = next_level
+        leaf_children = np.full(self.action_space.n, -1, dtype="int64")
+        leaf_rewards = np.zeros(self.action_space.n)
+        children += [leaf_children] * (len(nodes) - len(children))
+        rewards += [leaf_rewards] * (len(nodes) - len(rewards))
+        chain_numbers = np.array([min(node.chain_number, self.max_chain - 1) for node in nodes])
+        observations = None
+        if include_observations:
+            observations = empty_observations(len(nodes), self.encoding, root.num_colors, root.height)
+            for node, out in zip(nodes, observations):
+                self.encode(node, out=out)
+        return GameTree(chain_numbers, observations, np.array(children), np.array(rewards))
+
+    def get_action_mask(self):
+        """Boolean vector marking the actions that can change the board. See State.get_action_mask."""
+        return self.state.get_action_mask()
+
     def get_root(self):
         clone = self.state.clone()
         clone.seed()
         return clone
 
 
+class PdPEndlessVecEnv(gym.Env):
+    """
+    Vectorized Panel de Pon environment. A batch of single player endless mode boards stepped in lockstep.
+    Takes an array of actions and returns arrays of chain numbers, observations, rewards and dones.
+    The observation arrays are preallocated and overwritten on every step.
+    Boards are reset automatically once they reach max_episode_steps.
+    """
+
+    metadata = {"render.modes": ["human", "ansi"]}
+
+    def __init__(self, num_envs=16, height=HEIGHT, num_colors=NUM_COLORS, max_chain=MAX_CHAIN, max_episode_steps=200,
+                 encoding="float"):
+        self.num_envs = num_envs
+        self.state = BatchState(num_envs, scoring_method="endless", height=height, num_colors=num_colors)
+        self.max_chain = max_chain
+        self.max_episode_steps = max_episode_steps
+        self.encoding = encoding
+        self.reward_range = (0, self.max_chain)
+        self.action_space = spaces.Discrete((WIDTH - 1) * self.state.height + 2)
+        self.observation_space = spaces.Tuple((
+            spaces.Discrete(self.max_chain),
+            observation_box(encoding, self.state.num_colors, self.state.height),
+        ))
+        self.elapsed_steps = np.zeros(num_envs, dtype="int64")
+        self.chain_numbers = np.zeros(num_envs, dtype="int64")
+        self.observations = empty_observations(num_envs, encoding, self.state.num_colors, self.state.height)
+        self._seed()
+
+    def _seed(self, seed=None):
+        seed = self.state.seed(seed)
+        return [seed]
+
+    def _observe(self):
+        np.minimum(self.state.chain_number, self.max_chain - 1, out=self.chain_numbers)
+        if self.encoding == "packed":
+            self.state.encode_packed(out=self.observations)
+        else:
+            self.state.encode(out=self.observations)
+        return (self.chain_numbers, self.observations)
+
+    def _reset(self):
+        self.state.reset()
+        self.elapsed_steps[:] = 0
+        return self._observe()
+
+    def _render(self, mode="human", close=False):
+        if close:
+            return
+        outfile = StringIO() if mode == "ansi" else sys.stdout
+        outfile.write(render_batch(self.state))
+        return outfile
+
+    def _step(self, actions):
+        scores = self.state.step(actions)
+        rewards = np.minimum(scores, self.max_chain).astype("float")
+        self.elapsed_steps += 1
+        if self.max_episode_steps is None:
+            dones = np.zeros(self.num_envs, dtype=bool)
+        else:
+            dones = self.elapsed_steps >= self.max_episode_steps
+        if dones.any():
+            self.state.reset(dones)
+            self.elapsed_steps[dones] = 0
+        return self._observe(), rewards, dones, {"state": self.state}
+
+
 def register():
     gym.envs.registration.register(
         id="PdPEndless-v0",
@@ -91,3 +317,9 @@ def register():
         max_episode_steps=200,
         reward_threshold=25.0,
     )
+    gym.envs.registration.register(
+        id="PdPEndlessVec-v0",
+        entry_point="gym_paneldepon.env:PdPEndlessVecEnv",
+        kwargs={"num_envs": 16, "max_episode_steps": 200},
+        reward_threshold=25.0,
+    )
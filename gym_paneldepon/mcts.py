@@ -0,0 +1,243 @@
+"""
+Monte Carlo tree search over State driven by a batched leaf evaluator.
+
+Leaves are collected under virtual loss so that a single search gathers many distinct leaves
+before calling the evaluator once for all of them. Raising the stack is a chance node whose
+outcomes are the random rows drawn while searching.
+"""
+import numpy as np
+from gym.utils import seeding
+
+from gym_paneldepon.env import empty_observations
+from gym_paneldepon.planner import scored_clone
+from gym_paneldepon.state import ACTIONS, RAISE_STACK
+
+RAISE_ACTION = ACTIONS.index(RAISE_STACK)
+
+
+def uniform_evaluator(chain_numbers, observations):
+    """Uniform priors and zero values for every leaf"""
+    batch_size = len(observations)
+    return np.ones((batch_size, 1)), np.zeros(batch_size)
+
+
+class Node(object):
+    """
+    Decision node. The statistics of the edges to the children are kept in arrays indexed by action.
+    reward is the score received when the node was reached.
+    """
+    __slots__ = ("state", "reward", "mask", "priors", "visits", "value_sums", "children", "pending")
+
+    def __init__(self, state, reward=0):
+        self.state = state
+        self.reward = reward
+        self.mask = None
+        self.priors = None
+        self.visits = None
+        self.value_sums = None
+        self.children = None
+        self.pending = False
+
+    @property
+    def expanded(self):
+        return self.priors is not None
+
+    def expand(self, priors):
+        """Sets the priors of the unmasked actions normalized to sum to one"""
+        self.mask = self.state.get_action_mask()
+        num_actions = len(self.mask)
+        priors = np.broadcast_to(np.asarray(priors, dtype=float), (num_actions,)) * self.mask
+        total = priors.sum()
+        self.priors = priors / total if total > 0 else self.mask / self.mask.sum()
+        self.visits = np.zeros(num_actions)
+        self.value_sums = np.zeros(num_actions)
+        self.children = [None] * num_actions
+
+    def child(self, action, np_random):
+        """Child reached with the action. Chance children are resolved to one of their outcomes."""
+        child = self.children[action]
+        if child is None:
+            if action == RAISE_ACTION:
+                child = ChanceNode(self.state)
+            else:
+                state = self.state.clone()
+                child = Node(state, state.step(ACTIONS[action]))
+            self.children[action] = child
+        if isinstance(child, ChanceNode):
+            return child.sample(np_random)
+        return child
+
+
+class ChanceNode(object):
+    """
+    Outcomes of raising the stack keyed by the resulting state.
+    New outcomes are drawn until there are max_outcomes of them. After that the known outcomes are
+    revisited in proportion to how often they were drawn.
+    """
+    __slots__ = ("state", "outcomes", "counts")
+
+    max_outcomes = 8
+
+    def __init__(self, state):
+        self.state = state
+        self.outcomes = {}
+        self.counts = {}
+
+    def sample(self, np_random):
+        if len(self.outcomes) >= self.max_outcomes:
+            keys = list(self.counts)
+            counts = np.array([self.counts[key] for key in keys], dtype=float)
+            key = keys[np_random.choice(len(keys), p=counts / counts.sum())]
+            self.counts[key] += 1
+            return self.outcomes[key]
+        state = self.state.clone()
+        state.np_random = np_random
+        reward = state.step(RAISE_STACK)
+        state.np_random = None
+        key = state.key
+        if key not in self.outcomes:
+            self.outcomes[key] = Node(state, reward)
+            self.counts[key] = 0
+        self.counts[key] += 1
+        return self.outcomes[key]
+
+    def get(self, state):
+        return self.outcomes.get(state.key)
+
+
+class MCTS(object):
+    """
+    PUCT search with batched leaf evaluation.
+
+    The evaluator is called as evaluator(chain_numbers, observations) with a batch of encoded leaves
+    and returns the priors over the actions and the values of the leaves. The observation buffer is reused
+    between calls. Priors of actions masked out by State.get_action_mask are ignored since they have the same
+    effect as doing nothing. Values and rewards are discounted by discount per step. Exploration uses mean values
+    normalized to the range seen so far in the tree. Virtual loss is in reward units.
+    The root is copied with planner.scored_clone.
+    """
+
+    def __init__(
+            self, state, evaluator=uniform_evaluator, batch_size=64, c_puct=1.25, discount=0.95, virtual_loss=1.0,
+            encoding="float", seed=None):
+        self.evaluator = evaluator
+        self.batch_size = batch_size
+        self.c_puct = c_puct
+        self.discount = discount
+        self.virtual_loss = virtual_loss
+        self.encoding = encoding
+        self.np_random, _ = seeding.np_random(seed)
+        self.minimum = float("inf")
+        self.maximum = float("-inf")
+        self.root = Node(scored_clone(state))
+        self.observations = empty_observations(batch_size, encoding, state.num_colors, state.height)
+        self.chain_numbers = np.zeros(batch_size, dtype="int64")
+
+    def _normalize(self, values):
+        if self.maximum > self.minimum:
+            return (values - self.minimum) / (self.maximum - self.minimum)
+        return values
+
+    def _select_action(self, node):
+        visited = node.visits > 0
+        q = np.zeros(len(node.visits))
+        q[visited] = self._normalize(node.value_sums[visited] / node.visits[visited])
+        u = self.c_puct * node.priors * np.sqrt(node.visits.sum() + 1) / (1 + node.visits)
+        return int(np.argmax(np.where(node.mask, q + u, -np.inf)))
+
+    def _select_leaf(self):
+        """Descends to an unexpanded node applying virtual loss along the way. Returns the leaf and the path."""
+        node = self.root
+        path = []
+        while node.expanded:
+            action = self._select_action(node)
+            child = node.child(action, self.np_random)
+            node.visits[action] += 1
+            node.value_sums[action] -= self.virtual_loss
+            path.append((node, action, child))
+            node = child
+        return node, path
+
+    def _revert(self, path):
+        for node, action, child in path:
+            node.visits[action] -= 1
+            node.value_sums[action] += self.virtual_loss
+            if action == RAISE_ACTION:
+                node.children[action].counts[child.state.key] -= 1
+
+    def _backup(self, path, value):
+        for node, action, child in reversed(path):
+            value = child.reward + self.discount * value
+            node.value_sums[action] += self.virtual_loss + value
+            self.minimum = min(self.minimum, value)
+            self.maximum = max(self.maximum, value)
+
+    def _collect(self, max_leaves):
+        """Selects up to max_leaves distinct leaves. Gives up after as many collisions with pending leaves."""
+        leaves = []
+        collisions = 0
+        while len(leaves) < max_leaves and collisions < max_leaves:
+            leaf, path = self._select_leaf()
+            if leaf.pending:
+                self._revert(path)
+                collisions += 1
+                continue
+            leaf.pending = True
+            leaves.append((leaf, path))
+        return leaves
+
+    def _evaluate(self, leaves):
+        n = len(leaves)
+        observations = self.observations[:n]
+        for i, (leaf, _) in enumerate(leaves):
+            self.chain_numbers[i] = leaf.state.chain_number
+            if self.encoding == "packed":
+                leaf.state.encode_packed(out=observations[i])
+            else:
+                leaf.state.encode(out=observations[i])
+        priors, values = self.evaluator(self.chain_numbers[:n], observations)
+        for (leaf, path), leaf_priors, value in zip(leaves, priors, values):
+            leaf.pending = False
+            leaf.expand(leaf_priors)
+            self._backup(path, float(value))
+
+    def search(self, num_simulations):
+        """Runs simulations in batches of at most batch_size leaves. Returns the number of evaluator calls."""
+        calls = 0
+        done = 0
+        while done < num_simulations:
+            leaves = self._collect(min(self.batch_size, num_simulations - done))
+            self._evaluate(leaves)
+            done += len(leaves)
+            calls += 1
+        return calls
+
+    def get_policy(self, temperature=1.0):
+        """Distribution over the actions of the root proportional to the visit counts"""
+        visits = self.root.visits
+        if visits is None or not visits.any():
+            mask = self.root.state.get_action_mask()
+            return mask / mask.sum()
+        if temperature == 0:
+            policy = (visits == visits.max()).astype(float)
+        else:
+            policy = visits ** (1.0 / temperature)
+        return policy / policy.sum()
+
+    def best_action(self):
+        return int(np.argmax(self.get_policy(0)))
+
+    def advance(self, action, state):
+        """
+        Moves the root to the child reached by playing the action in the real environment keeping its subtree.
+        state is the state after the move. It resolves the outcome of raising the stack.
+        """
+        child = None
+        if self.root.expanded:
+            child = self.root.children[action]
+            if isinstance(child, ChanceNode):
+                child = child.get(state)
+        if child is None or child.state.key != state.key:
+            child = Node(scored_clone(state))
+        child.reward = 0
+        self.root = child
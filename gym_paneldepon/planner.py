@@ -0,0 +1,157 @@
+"""
+Chain planners searching action sequences over State.
+States without a scoring method are searched using the endless method, see scored_clone.
+"""
+import heapq
+import time
+from collections import namedtuple
+
+from gym_paneldepon.analysis import evaluate
+from gym_paneldepon.bitboard import WIDTH, get_matches, popcount
+from gym_paneldepon.state import ACTIONS, RAISE_STACK
+
+Plan = namedtuple("Plan", ["actions", "score"])
+
+
+def chaining_mass(state):
+    """Number of panels that will continue the chain when they land"""
+    return popcount(state.chaining)
+
+
+def pending_chain(state):
+    """Length of the longest chain the state produces if it is left alone, see analysis.ChainReport"""
+    return evaluate(state).chain_length
+
+
+def match_potential(state):
+    """Number of panels that would match if empty cells were filled with their color"""
+    empty = state.empty
+    potential = 0
+    for panels in state.colors:
+        potential += popcount(get_matches(panels | empty) & panels)
+    return potential
+
+
+class Node(object):
+    """
+    A search node. Children are expanded once and reused.
+    """
+    __slots__ = ("state", "parent", "action", "score", "children")
+
+    def __init__(self, state, parent=None, action=None, score=0):
+        self.state = state
+        self.parent = parent
+        self.action = action
+        self.score = score
+        self.children = None
+
+    @property
+    def actions(self):
+        actions = []
+        node = self
+        while node.parent is not None:
+            actions.append(node.action)
+            node = node.parent
+        return actions[::-1]
+
+    def expand(self, include_raise=False):
+        """Children reached with the actions that can change the board"""
+        if self.children is None:
+            self.children = []
+            mask = self.state.get_action_mask()
+            for action in range(2 + (WIDTH - 1) * self.state.height):
+                if ACTIONS[action] is RAISE_STACK and not include_raise:
+                    continue
+                if not mask[action]:
+                    continue
+                child = self.state.clone()
+                score = child.step(ACTIONS[action])
+                self.children.append(Node(child, self, action, self.score + score))
+        return self.children
+
+
+class _Budget(object):
+    def __init__(self, max_nodes, time_limit):
+        self.max_nodes = max_nodes
+        self.deadline = None if time_limit is None else time.time() + time_limit
+        self.nodes = 0
+
+    def spend(self, nodes):
+        self.nodes += nodes
+
+    @property
+    def exhausted(self):
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            return True
+        return self.deadline is not None and time.time() >= self.deadline
+
+
+def scored_clone(state):
+    """Copy of the state that is scored using the endless method unless it has a scoring method"""
+    state = state.clone()
+    if state.scoring_method is None:
+        state.scoring_method = "endless"
+    return state
+
+
+def beam_search(
+        state, heuristic=chaining_mass, beam_width=8, depth=50, max_nodes=None, time_limit=None,
+        include_raise=False):
+    """
+    Searches for the highest scoring action sequence keeping the beam_width most promising lines at each ply.
+    Lines are ranked by their score plus the heuristic value of the resulting state.
+    """
+    root = Node(scored_clone(state))
+    best = root
+    beam = [root]
+    budget = _Budget(max_nodes, time_limit)
+    for _ in range(depth):
+        candidates = {}
+        for node in beam:
+            if budget.exhausted:
+                break
+            children = node.expand(include_raise)
+            budget.spend(len(children))
+            for child in children:
+                key = child.state.key
+                if key not in candidates or child.score > candidates[key][1].score:
+                    candidates[key] = (child.score + heuristic(child.state), child)
+                if child.score > best.score:
+                    best = child
+        if not candidates:
+            break
+        ranked = sorted(candidates.values(), key=lambda candidate: -candidate[0])
+        beam = [node for _, node in ranked[:beam_width]]
+        if budget.exhausted:
+            break
+    return Plan(best.actions, best.score)
+
+
+def best_first_search(
+        state, heuristic=chaining_mass, depth=50, max_nodes=10000, time_limit=None, include_raise=False):
+    """
+    Searches for the highest scoring action sequence always expanding the most promising line first.
+    Lines are ranked by their score plus the heuristic value of the resulting state.
+    """
+    root = Node(scored_clone(state))
+    best = root
+    budget = _Budget(max_nodes, time_limit)
+    seen = set([root.state.key])
+    counter = 0
+    queue = [(0, counter, 0, root)]
+    while queue and not budget.exhausted:
+        _, _, ply, node = heapq.heappop(queue)
+        if ply >= depth:
+            continue
+        children = node.expand(include_raise)
+        budget.spend(len(children))
+        for child in children:
+            if child.score > best.score:
+                best = child
+            key = child.state.key
+            if key in seen:
+                continue
+            seen.add(key)
+            counter += 1
+            heapq.heappush(queue, (-(child.score + heuristic(child.state)), counter, ply + 1, child))
+    return Plan(best.actions, best.score)
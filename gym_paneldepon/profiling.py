@@ -0,0 +1,41 @@
+"""
+Opt-in instrumentation of the environment.
+
+A Profiler attached to a State accumulates the time spent in each phase of State.step.
+Clones share the profiler of the state they were cloned from. States without a profiler pay a single
+attribute check per step.
+"""
+from timeit import default_timer
+
+PHASES = ("swap", "drop_one", "clear_matches", "raise_stack", "encode")
+
+
+class Profiler(object):
+    """
+    Cumulative timers and call counters for each phase, the number of steps and clones and
+    the number of times raising the stack was blocked by a full top row.
+    """
+
+    timer = staticmethod(default_timer)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.steps = 0
+        self.clones = 0
+        self.raises_blocked = 0
+
+    def add(self, phase, seconds):
+        self.seconds[phase] += seconds
+        self.calls[phase] += 1
+
+    def as_dict(self):
+        return {
+            "steps": self.steps,
+            "clones": self.clones,
+            "raises_blocked": self.raises_blocked,
+            "phases": {phase: {"calls": self.calls[phase], "seconds": self.seconds[phase]} for phase in PHASES},
+        }
@@ -0,0 +1,66 @@
+"""
+Binary protocol of the environment server.
+
+Every request is a fixed size REQUEST frame. Every response is a RESPONSE frame followed by its payload.
+Requests carry an id that is echoed back so that a connection can have many requests in flight.
+Observations are sent in the packed encoding of State.encode_packed.
+This module only depends on numpy so that clients stay light.
+"""
+import struct
+
+import numpy as np
+
+# Request id, opcode, environment id, argument
+REQUEST = struct.Struct("<IBIi")
+# Request id, status, payload size
+RESPONSE = struct.Struct("<IBI")
+# Environment id, height, number of colors, number of actions
+CONFIG = struct.Struct("<IHHI")
+# Chain number, reward
+STEP_RESULT = struct.Struct("<id")
+
+CREATE = 0
+RESET = 1
+STEP = 2
+TREE = 3
+CLOSE = 4
+
+OK = 0
+ERROR = 1
+
+
+class ServerError(Exception):
+    pass
+
+
+def encode_step(chain_number, reward, observation):
+    return STEP_RESULT.pack(chain_number, reward) + np.asarray(observation, dtype="<u8").tobytes()
+
+
+def decode_step(payload, num_colors):
+    """Returns (chain_number, observation), reward"""
+    chain_number, reward = STEP_RESULT.unpack_from(payload)
+    observation = np.frombuffer(payload, dtype="<u8", offset=STEP_RESULT.size).reshape(num_colors + 3, 2)
+    return (chain_number, observation), reward
+
+
+def encode_tree(tree):
+    return b"".join([
+        np.asarray(tree.chain_numbers, dtype="<i8").tobytes(),
+        np.asarray(tree.rewards, dtype="<f8").tobytes(),
+        np.asarray(tree.mask, dtype="u1").tobytes(),
+        np.asarray(tree.observations, dtype="<u8").tobytes(),
+    ])
+
+
+def decode_tree(payload, num_colors, num_actions):
+    """Returns chain numbers, observations, rewards and the action mask of every child"""
+    offset = 0
+    chain_numbers = np.frombuffer(payload, dtype="<i8", count=num_actions, offset=offset)
+    offset += 8 * num_actions
+    rewards = np.frombuffer(payload, dtype="<f8", count=num_actions, offset=offset)
+    offset += 8 * num_actions
+    mask = np.frombuffer(payload, dtype="u1", count=num_actions, offset=offset).astype(bool)
+    offset += num_actions
+    observations = np.frombuffer(payload, dtype="<u8", offset=offset).reshape(num_actions, num_colors + 3, 2)
+    return chain_numbers, observations, rewards, mask
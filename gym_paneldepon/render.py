@@ -0,0 +1,133 @@
+"""
+ANSI rendering of boards.
+
+Every cell is reduced to a glyph code from which the complete escape sequence of the cell is looked up,
+so a frame is built as a single string. FrameDiffer only rewrites the cells that changed since the last frame.
+"""
+from __future__ import unicode_literals
+
+import numpy as np
+
+from gym_paneldepon.bitboard import HALF_BLOCKS, HEIGHT, TOP, WIDTH, row_table
+
+# Glyph codes are color * 8 + chaining * 4 + falling * 2 + swapping where color 0 means an empty cell
+MAX_COLORS = 7
+_TOP = np.uint64(TOP)
+_ROW_SHIFTS = np.arange(0, HALF_BLOCKS, WIDTH, dtype="uint64")
+CURSOR_UP = "\x1b[{}A"
+CURSOR_DOWN = "\x1b[{}B"
+CURSOR_COLUMN = "\x1b[{}G"
+CLEAR_LINE_END = "\x1b[K"
+
+
+def _glyph(code):
+    color = code >> 3
+    swapping = code & 1
+    if not color:
+        return ("\u2015" if swapping else "\u00b7") + " \x1b[0m"
+    if code & 4:
+        prefix = "\x1b[3{};1m".format(color)
+    else:
+        prefix = "\x1b[3{}m".format(color)
+    if code & 2:
+        symbol = "\u25a5" if swapping else "\u25a1"
+    else:
+        symbol = "\u25a4" if swapping else "\u25a3"
+    return prefix + symbol + " \x1b[0m"
+
+
+GLYPHS = [_glyph(code) for code in range(8 * (MAX_COLORS + 1))]
+# Glyph code contribution of each feature by number of colors. Features are the colors, falling, chaining and swapping.
+_WEIGHTS = [np.array([8 * (i + 1) for i in range(n)] + [2, 4, 1], dtype="int64") for n in range(MAX_COLORS + 1)]
+_CODE_TABLE = row_table("int64")
+
+
+def glyph_codes(planes, height):
+    """
+    Glyph codes of shape (..., height, WIDTH) from packed encodings of shape (..., num_colors + 3, 2).
+    See State.encode_packed.
+    """
+    planes = np.asarray(planes, dtype="uint64")
+    num_colors = planes.shape[-2] - 3
+    if num_colors > MAX_COLORS:
+        raise ValueError("At most {} colors can be rendered".format(MAX_COLORS))
+    rows = (planes[..., np.newaxis] >> _ROW_SHIFTS) & _TOP
+    rows = rows.reshape(planes.shape[:-1] + (HEIGHT,))[..., :height]
+    weights = _WEIGHTS[num_colors]
+    bits = _CODE_TABLE[rows].reshape(planes.shape[:-1] + (height * WIDTH,))
+    return np.matmul(weights, bits).reshape(planes.shape[:-2] + (height, WIDTH))
+
+
+def _rows(codes):
+    return ["".join([GLYPHS[code] for code in row]) for row in codes.tolist()]
+
+
+def _chain_line(chain_number):
+    return "chain={}".format(chain_number)
+
+
+def render_frame(state):
+    """The output of State.render as a single string"""
+    rows = _rows(glyph_codes(state.encode_packed(), state.height))
+    rows.append(_chain_line(state.chain_number))
+    rows.append("")
+    return "\n".join(rows)
+
+
+def render_batch(states, columns=8, separator="  "):
+    """
+    Renders boards side by side into a single string with at most columns boards per band.
+    states is a sequence of State or a BatchState.
+    """
+    if hasattr(states, "batch_size"):
+        planes = states.encode_packed()
+        height = states.height
+        chain_numbers = states.chain_number.tolist()
+    else:
+        planes = np.array([state.encode_packed() for state in states])
+        height = states[0].height
+        chain_numbers = [state.chain_number for state in states]
+    boards = [_rows(codes) for codes in glyph_codes(planes, height)]
+    bands = []
+    for start in range(0, len(boards), columns):
+        band = boards[start:start + columns]
+        lines = [separator.join(rows) for rows in zip(*band)]
+        chains = [_chain_line(chain_number).ljust(2 * WIDTH) for chain_number in chain_numbers[start:start + columns]]
+        lines.append(separator.join(chains).rstrip())
+        bands.append("\n".join(lines) + "\n")
+    return "\n".join(bands)
+
+
+class FrameDiffer(object):
+    """
+    Produces the strings that redraw a board in place.
+    The first frame is drawn in full. Later frames assume the cursor is at the start of the line below
+    the previous frame, rewrite only the cells that changed and leave the cursor there again.
+    """
+
+    def __init__(self):
+        self.codes = None
+
+    def reset(self):
+        self.codes = None
+
+    def diff(self, state):
+        codes = glyph_codes(state.encode_packed(), state.height)
+        previous = self.codes
+        self.codes = codes
+        if previous is None or previous.shape != codes.shape:
+            return render_frame(state)
+        height = len(codes)
+        result = [CURSOR_UP.format(height + 1)]
+        row = 0
+        for index in np.flatnonzero(codes != previous).tolist():
+            y, x = divmod(index, WIDTH)
+            if y != row:
+                result.append(CURSOR_DOWN.format(y - row))
+                row = y
+            result.append(CURSOR_COLUMN.format(2 * x + 1))
+            result.append(GLYPHS[codes[y, x]])
+        if height != row:
+            result.append(CURSOR_DOWN.format(height - row))
+        result.append("\r" + _chain_line(state.chain_number) + CLEAR_LINE_END + "\n")
+        return "".join(result)
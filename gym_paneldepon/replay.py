@@ -0,0 +1,292 @@
+"""
+Append-only on-disk episode storage.
+
+A replay file starts with a fixed size header followed by one fixed size record per step.
+A record holds the raw bitboards of the state before the step, its chain number, the action taken and the reward.
+Every bitboard is stored as a little-endian 72 bit integer in PANEL_BYTES bytes.
+The last record of each episode holds the final state with action NO_ACTION.
+Episodes are listed in an index file next to the replay file as (first record, number of records) pairs.
+With six colors a record takes 84 bytes.
+
+Single episodes can also be kept as an EpisodeLog of actions and periodic serialized keyframes.
+"""
+import os
+import struct
+from collections import namedtuple
+
+import gym
+import numpy as np
+
+from gym_paneldepon.batch import decode_packed
+from gym_paneldepon.bitboard import HALF_BLOCKS, HALF_FULL, NUM_BLOCKS
+from gym_paneldepon.state import ACTIONS, State
+
+MAGIC = b"PDPREPL1"
+HEADER = struct.Struct("<8sHHH")
+HEADER_SIZE = 16
+PANEL_BYTES = NUM_BLOCKS // 8
+NO_ACTION = 255
+
+_HALF_FULL = np.uint64(HALF_FULL)
+_HALF_BLOCKS = np.uint64(HALF_BLOCKS)
+_HIGH_SHIFT = np.uint64(64 - HALF_BLOCKS)
+_BYTE = np.uint64(0xff)
+
+ReplayBatch = namedtuple("ReplayBatch", ["chain_numbers", "observations", "actions", "rewards"])
+
+
+def record_dtype(num_colors):
+    return np.dtype([
+        ("panels", "u1", (num_colors + 3, PANEL_BYTES)),
+        ("chain_number", "u1"),
+        ("action", "u1"),
+        ("reward", "u1"),
+    ])
+
+
+def pack_halves(halves, out):
+    """Stores packed encodings into the trailing axis of out as little-endian 72 bit integers"""
+    halves = np.asarray(halves, dtype="uint64")
+    low = halves[..., 0] | (halves[..., 1] << _HALF_BLOCKS)
+    out[..., :8] = low[..., np.newaxis].astype("<u8").view("u1")
+    out[..., 8] = halves[..., 1] >> _HIGH_SHIFT
+    return out
+
+
+def unpack_halves(data):
+    """Inverse of pack_halves"""
+    data = np.asarray(data, dtype="u1")
+    low = np.ascontiguousarray(data[..., :8]).view("<u8")[..., 0].astype("uint64")
+    high = data[..., 8].astype("uint64")
+    halves = np.empty(data.shape[:-1] + (2,), dtype="uint64")
+    halves[..., 0] = low & _HALF_FULL
+    halves[..., 1] = (low >> _HALF_BLOCKS) | ((high & _BYTE) << _HIGH_SHIFT)
+    return halves
+
+
+def _read_header(infile):
+    magic, num_colors, height, max_chain = HEADER.unpack(infile.read(HEADER_SIZE)[:HEADER.size])
+    if magic != MAGIC:
+        raise ValueError("Not a replay file")
+    return num_colors, height, max_chain
+
+
+class ReplayWriter(object):
+    """
+    Appends episodes to a replay file creating it if necessary.
+    Records are buffered and written buffer_size at a time. The index is updated when an episode ends.
+    """
+
+    def __init__(self, path, num_colors, height, max_chain, buffer_size=4096):
+        self.path = path
+        self.num_colors = num_colors
+        self.height = height
+        self.max_chain = max_chain
+        self.dtype = record_dtype(num_colors)
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as infile:
+                if _read_header(infile) != (num_colors, height, max_chain):
+                    raise ValueError("Replay file {} has a different configuration".format(path))
+            episodes = np.fromfile(path + ".idx", dtype="<i8").reshape(-1, 2)
+            self.num_records = int(episodes[-1].sum()) if len(episodes) else 0
+            # Records past the last indexed episode belong to an unfinished episode
+            self.outfile = open(path, "r+b")
+            self.outfile.truncate(HEADER_SIZE + self.num_records * self.dtype.itemsize)
+            self.outfile.seek(0, os.SEEK_END)
+        else:
+            self.outfile = open(path, "wb")
+            self.outfile.write(HEADER.pack(MAGIC, num_colors, height, max_chain).ljust(HEADER_SIZE, b"\0"))
+            open(path + ".idx", "wb").close()
+            self.num_records = 0
+        self.index = open(path + ".idx", "ab")
+        self.buffer = np.zeros(buffer_size, dtype=self.dtype)
+        self.buffered = 0
+        self.episode_start = None
+
+    def _append(self, state, action, reward):
+        record = self.buffer[self.buffered]
+        pack_halves(state.encode_packed(), record["panels"])
+        record["chain_number"] = min(state.chain_number, 255)
+        record["action"] = action
+        record["reward"] = min(reward, 255)
+        self.buffered += 1
+        self.num_records += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+    def write(self, state, action, reward):
+        """Records a step taken with action from state receiving reward"""
+        if self.episode_start is None:
+            self.episode_start = self.num_records
+        self._append(state, action, reward)
+
+    def end_episode(self, state):
+        """Records the final state of the current episode"""
+        if self.episode_start is None:
+            return
+        self._append(state, NO_ACTION, 0)
+        self.flush()
+        np.array([self.episode_start, self.num_records - self.episode_start], dtype="<i8").tofile(self.index)
+        self.index.flush()
+        self.episode_start = None
+
+    def flush(self):
+        self.outfile.write(self.buffer[:self.buffered].tobytes())
+        self.outfile.flush()
+        self.buffered = 0
+
+    def close(self):
+        if self.outfile.closed:
+            return
+        self.flush()
+        self.outfile.close()
+        self.index.close()
+
+
+class ReplayReader(object):
+    """
+    Memory-mapped view of a replay file. Only the records that are accessed are read from disk.
+    Observations are decoded lazily with the same layout as PdPEndlessEnv.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as infile:
+            self.num_colors, self.height, self.max_chain = _read_header(infile)
+        self.dtype = record_dtype(self.num_colors)
+        self.episodes = np.fromfile(path + ".idx", dtype="<i8").reshape(-1, 2)
+        num_records = int(self.episodes[-1].sum()) if len(self.episodes) else 0
+        if num_records:
+            self.records = np.memmap(path, dtype=self.dtype, mode="r", offset=HEADER_SIZE, shape=(num_records,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def num_episodes(self):
+        return len(self.episodes)
+
+    def episode(self, index):
+        """Records of an episode"""
+        start, length = self.episodes[index]
+        return self.records[start:start + length]
+
+    def observations(self, indices, encoding="float", out=None):
+        """Chain numbers and observations of the records at indices"""
+        records = self.records[indices]
+        chain_numbers = np.minimum(records["chain_number"], self.max_chain - 1).astype("int64")
+        planes = unpack_halves(records["panels"])
+        if encoding == "packed":
+            if out is not None:
+                out[...] = planes
+                planes = out
+            return chain_numbers, planes
+        return chain_numbers, decode_packed(planes, self.height, out=out, dtype=encoding)
+
+    def batch(self, indices, encoding="float", out=None):
+        chain_numbers, observations = self.observations(indices, encoding, out)
+        records = self.records[indices]
+        return ReplayBatch(
+            chain_numbers, observations, records["action"].astype("int64"), records["reward"].astype("float")
+        )
+
+    def get_state(self, index):
+        """Reconstructs the state of a record"""
+        record = self.records[index]
+        halves = unpack_halves(record["panels"])
+        features = [int(low) | (int(high) << HALF_BLOCKS) for low, high in halves]
+        state = State(scoring_method="endless", height=self.height, num_colors=self.num_colors)
+        state.colors = features[:self.num_colors]
+        state.falling, state.chaining, state.swapping = features[self.num_colors:]
+        state.chain_number = int(record["chain_number"])
+        return state
+
+
+class Recorder(gym.Wrapper):
+    """
+    Records the episodes of a PdPEndlessEnv to a replay file.
+    The environment may be wrapped in other wrappers that don't change the state.
+    """
+
+    def __init__(self, env, path, buffer_size=4096):
+        super(Recorder, self).__init__(env)
+        state = env.unwrapped.state
+        self.writer = ReplayWriter(path, state.num_colors, state.height, env.unwrapped.max_chain, buffer_size)
+
+    def _reset(self, **kwargs):
+        self.writer.end_episode(self.env.unwrapped.state)
+        return self.env.reset(**kwargs)
+
+    def _step(self, action):
+        state = self.env.unwrapped.state.clone()
+        observation, reward, done, info = self.env.step(action)
+        self.writer.write(state, action, int(reward))
+        if done:
+            self.writer.end_episode(self.env.unwrapped.state)
+        return observation, reward, done, info
+
+    def _close(self):
+        self.writer.end_episode(self.env.unwrapped.state)
+        self.writer.close()
+        return self.env.close()
+
+
+class EpisodeLog(object):
+    """
+    An episode stored as its action sequence with a serialized keyframe every keyframe_interval steps.
+    Any step can be reconstructed by loading the keyframe before it and replaying at most
+    keyframe_interval - 1 actions. Replays are exact because keyframes include the random state
+    used to raise the stack, as long as the actions weren't drawn from the state's own generator.
+    """
+
+    def __init__(self, state, keyframe_interval=100):
+        self.keyframe_interval = keyframe_interval
+        # Make sure the generator exists so that it ends up in the keyframe
+        if state._np_random is None:
+            state.seed()
+        self.keyframes = [state.serialize()]
+        self.actions = []
+
+    def __len__(self):
+        return len(self.actions)
+
+    def append(self, action, state):
+        """Records an action and the state it resulted in"""
+        self.actions.append(action)
+        if len(self.actions) % self.keyframe_interval == 0:
+            self.keyframes.append(state.serialize())
+
+    def seek(self, step):
+        """The state after the given number of steps"""
+        if not 0 <= step <= len(self.actions):
+            raise IndexError("Step {} out of range".format(step))
+        keyframe = step // self.keyframe_interval
+        state = State.deserialize(self.keyframes[keyframe])
+        for action in self.actions[keyframe * self.keyframe_interval:step]:
+            state.step(ACTIONS[action])
+        return state
+
+    def to_bytes(self):
+        chunks = [struct.pack("<III", self.keyframe_interval, len(self.actions), len(self.keyframes))]
+        chunks.append(np.array(self.actions, dtype="u1").tobytes())
+        for keyframe in self.keyframes:
+            chunks.append(struct.pack("<I", len(keyframe)))
+            chunks.append(keyframe)
+        return b"".join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data):
+        keyframe_interval, num_actions, num_keyframes = struct.unpack_from("<III", data)
+        offset = 12
+        instance = cls.__new__(cls)
+        instance.keyframe_interval = keyframe_interval
+        instance.actions = np.frombuffer(data, dtype="u1", count=num_actions, offset=offset).tolist()
+        offset += num_actions
+        instance.keyframes = []
+        for _ in range(num_keyframes):
+            size, = struct.unpack_from("<I", data, offset)
+            offset += 4
+            instance.keyframes.append(data[offset:offset + size])
+            offset += size
+        return instance
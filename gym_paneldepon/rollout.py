@@ -0,0 +1,156 @@
+"""
+Parallel self-play rollouts.
+
+Episodes are sharded across a process pool. Every episode is seeded from the base seed and its index only,
+so the trajectories don't depend on the number of workers or on how the episodes were scheduled.
+Workers write their trajectories straight into shared memory buffers instead of pickling states back.
+"""
+import multiprocessing
+from collections import namedtuple
+from ctypes import c_char
+
+import numpy as np
+from gym.utils import seeding
+
+from gym_paneldepon.bitboard import HEIGHT, WIDTH
+from gym_paneldepon.state import ACTIONS, NUM_COLORS, State
+
+# actions[i, t] and rewards[i, t] are the action taken and the reward received at step t of episode i.
+# observations[i, t] is the packed encoding of the state before step t. The last one is the final state.
+Rollouts = namedtuple("Rollouts", ["actions", "rewards", "observations"])
+
+# Buffers of the current worker process
+_worker = {}
+
+
+def random_policy(state):
+    """Random play as in misc/random_demo.py. Raises the stack one step in five."""
+    if state.np_random.randint(0, 5):
+        return state.np_random.randint(0, 2 + (WIDTH - 1) * state.height)
+    return 1
+
+
+def episode_seed(seed, episode):
+    return seeding.hash_seed(seed + episode)
+
+
+def _shared_array(shape, dtype):
+    dtype = np.dtype(dtype)
+    raw = multiprocessing.RawArray(c_char, max(1, int(np.prod(shape)) * dtype.itemsize))
+    return raw, _view(raw, shape, dtype)
+
+
+def _view(raw, shape, dtype):
+    return np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _play(rollouts, config, start, stop, seed):
+    actions, rewards, observations = rollouts
+    for episode in range(start, stop):
+        state = State(scoring_method="endless", height=config["height"], num_colors=config["num_colors"])
+        state.seed(episode_seed(seed, episode))
+        for _ in range(config["initial_rows"]):
+            state.raise_stack()
+        for t in range(actions.shape[1]):
+            state.encode_packed(out=observations[episode, t])
+            action = config["policy"](state)
+            actions[episode, t] = action
+            rewards[episode, t] = state.step(ACTIONS[action])
+        state.encode_packed(out=observations[episode, -1])
+
+
+def _init_worker(raws, shapes, config):
+    _worker["rollouts"] = Rollouts(*(_view(raw, shape, dtype) for raw, (shape, dtype) in zip(raws, shapes)))
+    _worker["config"] = config
+
+
+def _play_chunk(task):
+    start, stop, seed = task
+    _play(_worker["rollouts"], _worker["config"], start, stop, seed)
+    return start, stop
+
+
+class RolloutService(object):
+    """
+    Plays batches of num_episodes episodes of episode_length steps on a pool of num_workers processes.
+    Each episode starts from initial_rows raised rows and picks its actions with policy(state),
+    a picklable function returning an action index. The policy should draw from state.np_random to stay deterministic.
+    With num_workers=0 the episodes are played in the calling process.
+    The result buffers are allocated once and overwritten by every run.
+    """
+
+    def __init__(
+            self, num_episodes, episode_length=200, num_workers=None, height=HEIGHT, num_colors=NUM_COLORS,
+            policy=random_policy, initial_rows=6, chunk_size=None):
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        self.num_episodes = num_episodes
+        self.episode_length = episode_length
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size or max(1, num_episodes // (4 * max(1, num_workers)))
+        self.config = {
+            "height": height,
+            "num_colors": num_colors,
+            "policy": policy,
+            "initial_rows": initial_rows,
+        }
+        shapes = [
+            ((num_episodes, episode_length), "int64"),
+            ((num_episodes, episode_length), "float64"),
+            ((num_episodes, episode_length + 1, num_colors + 3, 2), "uint64"),
+        ]
+        raws = []
+        arrays = []
+        for shape, dtype in shapes:
+            raw, array = _shared_array(shape, dtype)
+            raws.append(raw)
+            arrays.append(array)
+        self.rollouts = Rollouts(*arrays)
+        self.last_seed = None
+        self.pool = None
+        if num_workers:
+            self.pool = multiprocessing.Pool(
+                num_workers, initializer=_init_worker, initargs=(raws, shapes, self.config)
+            )
+
+    def stream(self, seed=None):
+        """
+        Plays a batch of episodes yielding the trajectories of each chunk of episodes as it completes.
+        The yielded rollouts are views of the shared buffers. The seed used is kept in last_seed.
+        """
+        if seed is None:
+            seed = seeding.create_seed(max_bytes=4)
+        self.last_seed = seed
+        tasks = [
+            (start, min(start + self.chunk_size, self.num_episodes), seed)
+            for start in range(0, self.num_episodes, self.chunk_size)
+        ]
+        if self.pool is None:
+            results = (self._play_chunk(task) for task in tasks)
+        else:
+            results = self.pool.imap_unordered(_play_chunk, tasks)
+        for start, stop in results:
+            yield Rollouts(*(array[start:stop] for array in self.rollouts))
+
+    def _play_chunk(self, task):
+        start, stop, seed = task
+        _play(self.rollouts, self.config, start, stop, seed)
+        return start, stop
+
+    def run(self, seed=None):
+        """Plays a batch of episodes and returns all the trajectories"""
+        for _ in self.stream(seed):
+            pass
+        return self.rollouts
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
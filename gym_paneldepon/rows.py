@@ -0,0 +1,122 @@
+"""
+Constructive generation of the rows inserted by raising the stack.
+
+A new row must not create matches. A color is forbidden in a column if the two panels above it
+already share that color and neither of them is protected. Inside the row no three panels in a row
+may share a color. Rows are drawn uniformly from the rows satisfying these constraints by counting
+the valid completions of every prefix, so no candidates need to be rejected.
+"""
+import numpy as np
+
+from gym_paneldepon.bitboard import TOP, WIDTH, down
+
+
+def forbidden_colors(colors, protected, height):
+    """List of the color forbidden in each column of a new row or -1 if any color will do"""
+    forbidden = [-1] * WIDTH
+    if height < 3:
+        return forbidden
+    shift = WIDTH * (height - 1)
+    for i, panels in enumerate(colors):
+        panels &= ~protected
+        pairs = ((panels & down(panels)) >> shift) & TOP
+        for j in range(WIDTH):
+            if pairs & (1 << j):
+                forbidden[j] = i
+    return forbidden
+
+
+def count_completions(forbidden, num_colors):
+    """
+    Number of valid ways to fill the rest of a row.
+    completions[j][c][r] counts the fillings of columns j onwards when column j - 1 has color c
+    ending a run of r panels of that color.
+    """
+    completions = [[[1, 1, 1] for _ in range(num_colors)]]
+    for j in range(WIDTH - 1, 0, -1):
+        following = completions[0]
+        current = [[0, 0, 0] for _ in range(num_colors)]
+        for previous in range(num_colors):
+            for run in (1, 2):
+                total = 0
+                for color in range(num_colors):
+                    if color == forbidden[j]:
+                        continue
+                    if color == previous:
+                        if run < 2:
+                            total += following[color][run + 1]
+                    else:
+                        total += following[color][1]
+                current[previous][run] = total
+        completions.insert(0, current)
+    return [None] + completions
+
+
+def sample_row(np_random, forbidden, num_colors):
+    """Draws a valid row uniformly at random"""
+    completions = count_completions(forbidden, num_colors)
+    row = []
+    previous = None
+    run = 0
+    for j in range(WIDTH):
+        weights = []
+        for color in range(num_colors):
+            if color == forbidden[j] or (color == previous and run == 2):
+                weights.append(0)
+            else:
+                weights.append(completions[j + 1][color][run + 1 if color == previous else 1])
+        total = sum(weights)
+        if not total:
+            raise ValueError("No valid rows with {} colors".format(num_colors))
+        choice = np_random.randint(0, total)
+        for color, weight in enumerate(weights):
+            if choice < weight:
+                break
+            choice -= weight
+        run = run + 1 if color == previous else 1
+        previous = color
+        row.append(color)
+    return row
+
+
+def sample_rows(np_random, forbidden, num_colors):
+    """
+    Draws a valid row for each board at once.
+    forbidden is an array of shape (num_boards, WIDTH) as given by forbidden_colors for each board.
+    """
+    forbidden = np.asarray(forbidden)
+    num_boards = len(forbidden)
+    colors = np.arange(num_colors)
+    # completions[j] has shape (num_boards, num_colors, 3) like the lists of count_completions
+    completions = [None] * (WIDTH + 1)
+    completions[WIDTH] = np.ones((num_boards, num_colors, 3))
+    for j in range(WIDTH - 1, 0, -1):
+        allowed = colors[np.newaxis, :] != forbidden[:, j, np.newaxis]
+        following = completions[j + 1]
+        fresh = (following[:, :, 1] * allowed).sum(axis=1)
+        current = np.zeros((num_boards, num_colors, 3))
+        for previous in range(num_colors):
+            same = following[:, previous, 2] * allowed[:, previous]
+            current[:, previous, 1] = fresh - following[:, previous, 1] * allowed[:, previous] + same
+            current[:, previous, 2] = fresh - following[:, previous, 1] * allowed[:, previous]
+        completions[j] = current
+    rows = np.zeros((num_boards, WIDTH), dtype="int64")
+    uniforms = np_random.random_sample((num_boards, WIDTH))
+    boards = np.arange(num_boards)
+    previous = np.full(num_boards, -1)
+    run = np.zeros(num_boards, dtype="int64")
+    for j in range(WIDTH):
+        same = colors[np.newaxis, :] == previous[:, np.newaxis]
+        allowed = (colors[np.newaxis, :] != forbidden[:, j, np.newaxis]) & ~(same & (run[:, np.newaxis] == 2))
+        following = completions[j + 1]
+        weights = np.where(same, following[boards, :, np.minimum(run + 1, 2)], following[:, :, 1])
+        weights = weights * allowed
+        cumulative = weights.cumsum(axis=1)
+        total = cumulative[:, -1]
+        if not total.all():
+            raise ValueError("No valid rows with {} colors".format(num_colors))
+        color = (cumulative <= (uniforms[:, j] * total)[:, np.newaxis]).sum(axis=1)
+        run = np.where(color == previous, run + 1, 1)
+        previous = color
+        rows[:, j] = color
+    return rows
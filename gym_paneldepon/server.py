@@ -0,0 +1,206 @@
+"""
+Asyncio server hosting many endless mode boards. Requires Python 3.5 or later.
+
+Step requests that arrive during the same iteration of the event loop are coalesced into a single
+BatchState step. Observations are sent back in the packed encoding. See protocol.py for the wire format.
+"""
+import asyncio
+from collections import deque
+
+import numpy as np
+
+from gym_paneldepon.batch import BatchState
+from gym_paneldepon.bitboard import HEIGHT
+from gym_paneldepon.client import BaseClient
+from gym_paneldepon.env import MAX_CHAIN, PdPEndlessEnv
+from gym_paneldepon.protocol import (
+    CLOSE, CONFIG, CREATE, ERROR, OK, REQUEST, RESET, RESPONSE, STEP, TREE, encode_step, encode_tree
+)
+from gym_paneldepon.state import NUM_COLORS
+
+
+class EnvServer(object):
+    """
+    Hosts up to max_envs boards in a single BatchState.
+    Rewards and chain numbers are capped like in PdPEndlessEnv.
+
+    Requests for an environment are executed in the order they arrive. Each environment has a queue of requests.
+    Steps at the front of the queues are run together in the next batch and the requests behind them wait their turn.
+    """
+
+    def __init__(self, max_envs=1024, height=HEIGHT, num_colors=NUM_COLORS, max_chain=MAX_CHAIN, seed=None):
+        self.boards = BatchState(max_envs, scoring_method="endless", height=height, num_colors=num_colors)
+        self.boards.seed(seed)
+        self.max_chain = max_chain
+        # Expands search trees one environment at a time
+        self.expander = PdPEndlessEnv(height=height, num_colors=num_colors, max_chain=max_chain, encoding="packed")
+        self.free = list(range(max_envs - 1, -1, -1))
+        self.active = set()
+        # Queued (opcode, argument, future) requests of each environment and the ones with a step at the front
+        self.queues = {}
+        self.ready = []
+        self.flush_scheduled = False
+        self.num_steps = 0
+        self.num_batches = 0
+
+    @property
+    def num_actions(self):
+        return self.expander.action_space.n
+
+    def _check(self, env_id):
+        if env_id not in self.active:
+            raise ValueError("Unknown environment {}".format(env_id))
+
+    def create(self):
+        if not self.free:
+            raise ValueError("Too many environments")
+        env_id = self.free.pop()
+        self.boards.reset([env_id])
+        self.active.add(env_id)
+        return env_id
+
+    def close_env(self, env_id):
+        self._check(env_id)
+        self.active.remove(env_id)
+        self.free.append(env_id)
+
+    def reset(self, env_id):
+        """Returns the chain number and the packed observation"""
+        self._check(env_id)
+        self.boards.reset([env_id])
+        return 0, self.boards.take([env_id]).encode_packed()[0]
+
+    def get_tree(self, env_id):
+        self._check(env_id)
+        self.expander.state = self.boards.get_state(env_id)
+        return self.expander.get_tree_batch()
+
+    def submit(self, opcode, env_id, argument=0):
+        """Queues a request for an environment. Returns a future of its result."""
+        future = asyncio.get_event_loop().create_future()
+        queue = self.queues.setdefault(env_id, deque())
+        queue.append((opcode, argument, future))
+        if len(queue) == 1:
+            self._advance(env_id)
+        return future
+
+    def step(self, env_id, action):
+        """Future of the chain number, the reward and the packed observation"""
+        return self.submit(STEP, env_id, action)
+
+    def _execute(self, opcode, env_id, argument):
+        if opcode == RESET:
+            return self.reset(env_id)
+        elif opcode == TREE:
+            return self.get_tree(env_id)
+        elif opcode == CLOSE:
+            return self.close_env(env_id)
+        raise ValueError("Unknown opcode {}".format(opcode))
+
+    def _advance(self, env_id):
+        """Runs the requests at the front of the queue until it's empty or a step has to wait for a batch"""
+        queue = self.queues[env_id]
+        while queue:
+            opcode, argument, future = queue[0]
+            try:
+                if opcode == STEP:
+                    self._check(env_id)
+                    if not 0 <= argument < self.num_actions:
+                        raise ValueError("Invalid action {}".format(argument))
+                    self.ready.append(env_id)
+                    if not self.flush_scheduled:
+                        self.flush_scheduled = True
+                        asyncio.get_event_loop().call_soon(self.flush)
+                    return
+                result = self._execute(opcode, env_id, argument)
+            except Exception as error:
+                if not future.cancelled():
+                    future.set_exception(error)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            queue.popleft()
+        del self.queues[env_id]
+
+    def flush(self):
+        """Steps every environment with a step at the front of its queue in one batch"""
+        self.flush_scheduled = False
+        env_ids = self.ready
+        self.ready = []
+        if not env_ids:
+            return
+        indices = np.array(env_ids)
+        actions = np.array([self.queues[env_id][0][1] for env_id in env_ids])
+        boards = self.boards.take(indices)
+        rewards = np.minimum(boards.step(actions), self.max_chain)
+        self.boards.put(indices, boards)
+        chain_numbers = np.minimum(boards.chain_number, self.max_chain - 1)
+        observations = boards.encode_packed()
+        self.num_steps += len(env_ids)
+        self.num_batches += 1
+        for i, env_id in enumerate(env_ids):
+            _, _, future = self.queues[env_id].popleft()
+            if not future.cancelled():
+                future.set_result((int(chain_numbers[i]), float(rewards[i]), observations[i]))
+            self._advance(env_id)
+
+    async def dispatch(self, opcode, env_id, argument):
+        """Executes a request. Returns the status and the payload of the response."""
+        try:
+            if opcode == CREATE:
+                env_id = self.create()
+                payload = CONFIG.pack(env_id, self.boards.height, self.boards.num_colors, self.num_actions)
+            elif opcode == RESET:
+                chain_number, observation = await self.submit(RESET, env_id)
+                payload = encode_step(chain_number, 0, observation)
+            elif opcode == STEP:
+                payload = encode_step(*(await self.submit(STEP, env_id, argument)))
+            elif opcode == TREE:
+                payload = encode_tree(await self.submit(TREE, env_id))
+            elif opcode == CLOSE:
+                await self.submit(CLOSE, env_id)
+                payload = b""
+            else:
+                raise ValueError("Unknown opcode {}".format(opcode))
+        except Exception as error:
+            return ERROR, str(error).encode("utf-8")
+        return OK, payload
+
+    async def _respond(self, writer, lock, request_id, opcode, env_id, argument):
+        status, payload = await self.dispatch(opcode, env_id, argument)
+        async with lock:
+            writer.write(RESPONSE.pack(request_id, status, len(payload)) + payload)
+            await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        tasks = set()
+        # Serializes draining between the responses of the connection
+        lock = asyncio.Lock()
+        try:
+            while True:
+                request_id, opcode, env_id, argument = REQUEST.unpack(await reader.readexactly(REQUEST.size))
+                task = asyncio.ensure_future(self._respond(writer, lock, request_id, opcode, env_id, argument))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        if tasks:
+            await asyncio.wait(tasks)
+        writer.close()
+
+    async def start(self, path=None, host="127.0.0.1", port=0):
+        """Starts listening on a Unix socket if a path is given or on TCP otherwise. Returns the asyncio server."""
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, path)
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+class LocalClient(BaseClient):
+    """In-process client of an EnvServer. Goes through the same protocol without a socket."""
+
+    def __init__(self, server):
+        super(LocalClient, self).__init__()
+        self.server = server
+
+    async def _send(self, opcode, env_id, argument):
+        return await self.server.dispatch(opcode, env_id, argument)
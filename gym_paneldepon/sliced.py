@@ -0,0 +1,211 @@
+"""
+Bit-sliced variant of State.
+
+Instead of one bitboard per color the board is stored as an occupancy plane plus ceil(log2(num_colors))
+planes holding the bits of the color index of each panel. Gravity, swaps and raising the stack move
+those planes only. The per-color bitboards are derived on demand.
+"""
+from gym_paneldepon.bitboard import FULL, TOP, WIDTH, beam_up, down, get_matches, left, popcount, right, up
+from gym_paneldepon.state import RAISE_STACK, State
+
+
+def num_slices(num_colors):
+    return max(1, (num_colors - 1).bit_length())
+
+
+def split_colors(occupied, slices):
+    """Per-color bitboards of every color index the slices can hold"""
+    masks = [occupied]
+    for panels in slices:
+        inverse = ~panels
+        masks = [mask & inverse for mask in masks] + [mask & panels for mask in masks]
+    return masks
+
+
+class SlicedState(State):
+    """
+    State with bit-sliced colors. Behaves exactly like State.
+    colors is computed from the planes when read and converted into them when assigned,
+    so it can't be modified in place.
+    """
+    __slots__ = ("occupied", "slices")
+
+    @classmethod
+    def from_state(cls, state):
+        instance = object.__new__(cls)
+        instance.scoring_method = state.scoring_method
+        instance.height = state.height
+        instance.num_colors = state.num_colors
+        instance.colors = state.colors
+        instance.falling = state.falling
+        instance.swapping = state.swapping
+        instance.chaining = state.chaining
+        instance.chain_number = state.chain_number
+        instance._np_random = state._np_random
+        instance.profiler = state.profiler
+        return instance
+
+    @classmethod
+    def from_list(cls, stack, num_colors=None):
+        return cls.from_state(State.from_list(stack, num_colors))
+
+    def to_state(self):
+        """Equivalent State with one bitboard per color"""
+        state = State(scoring_method=self.scoring_method, height=self.height, num_colors=self.num_colors)
+        state.colors = self.colors
+        state.falling = self.falling
+        state.swapping = self.swapping
+        state.chaining = self.chaining
+        state.chain_number = self.chain_number
+        state._np_random = self._np_random
+        state.profiler = self.profiler
+        return state
+
+    @property
+    def colors(self):
+        return split_colors(self.occupied, self.slices)[:self.num_colors]
+
+    @colors.setter
+    def colors(self, colors):
+        self.occupied = 0
+        self.slices = [0] * num_slices(self.num_colors)
+        for i, panels in enumerate(colors):
+            self.occupied |= panels
+            for k in range(len(self.slices)):
+                if i & (1 << k):
+                    self.slices[k] |= panels
+
+    def sanitize(self):
+        self.occupied &= FULL
+        for k in range(len(self.slices)):
+            self.slices[k] &= self.occupied
+
+    def clone(self):
+        other = object.__new__(self.__class__)
+        other._np_random = None
+        other.profiler = self.profiler
+        if self.profiler is not None:
+            self.profiler.clones += 1
+        other.scoring_method = self.scoring_method
+        other.height = self.height
+        other.num_colors = self.num_colors
+        other.occupied = self.occupied
+        other.slices = self.slices[:]
+        other.falling = self.falling
+        other.swapping = self.swapping
+        other.chaining = self.chaining
+        other.chain_number = self.chain_number
+        return other
+
+    @property
+    def empty(self):
+        return FULL ^ self.occupied
+
+    def swap(self, index):
+        protected = self.swapping & up(self.empty)
+        self.swapping = 0
+        if index is None:
+            return
+        if index % WIDTH == WIDTH - 1:
+            raise ValueError("Cannot swap off screen")
+        if index >= self.height * WIDTH:
+            raise ValueError("Cannot swap off screen")
+        p = 1 << index
+        mask = ~(p | right(p))
+        if protected & ~mask:
+            return
+        swapping = (left(self.occupied) & p) | right(self.occupied & p)
+        self.occupied = (self.occupied & mask) | swapping
+        self.swapping = swapping
+        for k, panels in enumerate(self.slices):
+            self.slices[k] = (panels & mask) | (left(panels) & p) | right(panels & p)
+        c = self.chaining & self.falling
+        self.chaining &= mask
+        self.chaining |= (left(c) & p) | right(c & p)
+        # Air support needed for lateslips
+        if self.swapping:
+            self.swapping = ~mask
+
+    def drop_one(self):
+        self.falling = 0
+        empty = self.empty
+        protected = self.swapping
+        # Empty cells on the board with an unprotected panel above them
+        targets = down((FULL ^ empty) & ~protected) & empty & ~self.swapping & ((1 << (WIDTH * self.height)) - 1)
+        if not targets:
+            return
+        empty &= ~self.swapping  # Air support needed for lateslips
+        # Only the columns above a target are affected starting from the lowest target
+        lowest = (targets.bit_length() - 1) // WIDTH
+        affected = beam_up(targets)
+        slices = self.slices
+        row = TOP << (WIDTH * lowest)
+        for i in range(lowest):
+            cells = row & affected
+            falling = down(self.chaining & ~protected) & cells & empty
+            self.chaining |= falling
+            self.chaining ^= up(falling)
+            falling = down(self.occupied & ~protected) & cells & empty
+            if falling:
+                self.falling |= falling
+                source = up(falling)
+                self.occupied ^= falling | source
+                for k in range(len(slices)):
+                    slices[k] = (slices[k] & ~source) | down(slices[k] & source)
+                empty ^= source
+            row = up(row)
+
+    def clear_matches(self):
+        score = 0
+        chain_beam = 0
+        protected = self.falling | self.swapping
+        for panels in split_colors(self.occupied & ~protected, self.slices)[:self.num_colors]:
+            if panels:
+                chain_beam |= get_matches(panels)
+        combo_size = popcount(chain_beam)
+        if chain_beam:
+            self.occupied ^= chain_beam
+            for k in range(len(self.slices)):
+                self.slices[k] &= ~chain_beam
+        panels = self.occupied
+        if self.chaining & chain_beam:
+            self.chain_number += 1
+        if chain_beam:
+            score = self.chain_number + 1
+        chain_beam = up(chain_beam) & panels
+        for i in range(self.height):
+            chain_beam |= up(chain_beam) & panels
+        protected |= up(self.swapping)
+        self.chaining &= protected
+        self.chaining |= panels & chain_beam
+        if not self.chaining:
+            self.chain_number = 0
+        return score, combo_size
+
+    def _insert_row(self, row):
+        self.falling = up(self.falling)
+        self.chaining = up(self.chaining)
+        self.swapping = up(self.swapping)
+        self.occupied = up(self.occupied)
+        slices = [up(panels) for panels in self.slices]
+        offset = WIDTH * (self.height - 1)
+        for j, color in enumerate(row):
+            p = 1 << (j + offset)
+            self.occupied |= p
+            for k in range(len(slices)):
+                if color & (1 << k):
+                    slices[k] |= p
+        self.slices = slices
+
+    def step(self, action):
+        if self.profiler is not None:
+            return self._profiled_step(action)
+        if action is RAISE_STACK:
+            self.swapping = 0
+        else:
+            self.swap(action)
+        self.drop_one()
+        result = self.clear_matches()
+        if action is RAISE_STACK:
+            self.raise_stack()
+        return self.calculate_score(result)
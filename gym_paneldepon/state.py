@@ -1,16 +1,34 @@
 from __future__ import unicode_literals
 
+import struct
 import sys
 
 import numpy as np
 from gym.utils import seeding
 
-from gym_paneldepon.bitboard import FULL, HEIGHT, TOP, WIDTH  # noqa: I001
-from gym_paneldepon.bitboard import down, get_matches, left, panels_from_list, popcount, right, up  # noqa: I001
-from gym_paneldepon.util import print_color, print_reset
+from gym_paneldepon.bitboard import FULL, HEIGHT, NUM_BLOCKS, TOP, WIDTH  # noqa: I001
+from gym_paneldepon.bitboard import beam_up, down, get_matches, left, panels_from_list, panels_to_halves  # noqa: I001
+from gym_paneldepon.bitboard import panels_to_rows, popcount, right, row_table, up  # noqa: I001
+from gym_paneldepon.render import render_frame
+from gym_paneldepon.rows import forbidden_colors, sample_row
+
+try:
+    from gym_paneldepon import _native
+except ImportError:  # pragma: no cover
+    _native = None
 
 NUM_COLORS = 6
 
+SCORING_METHODS = (None, "endless")
+
+# Serialization format. Bitboards are stored as little-endian 72 bit integers.
+_HEADER = struct.Struct("<BBBBH")
+_PANELS = struct.Struct("<QB")
+_RANDOM = struct.Struct("<624IIBd")
+_SERIAL_VERSION = 1
+_HAS_RANDOM = 1
+_LOW = (1 << 64) - 1
+
 RAISE_STACK = object()
 ACTIONS = [None, RAISE_STACK]
 for i in range(HEIGHT):
@@ -19,6 +37,12 @@ for i in range(HEIGHT):
 
 
 class State(object):
+    __slots__ = (
+        "scoring_method", "height", "num_colors",
+        "colors", "falling", "swapping", "chaining", "chain_number",
+        "_np_random", "profiler",
+    )
+
     def __init__(self, scoring_method=None, height=HEIGHT, num_colors=NUM_COLORS):
         if height > HEIGHT:
             raise ValueError("The maximum height is {}".format(HEIGHT))
@@ -26,7 +50,8 @@ class State(object):
         self.height = height
         self.num_colors = num_colors
         self.reset()
-        self.seed()
+        self._np_random = None
+        self.profiler = None
 
     def reset(self):
         self.colors = [0] * self.num_colors
@@ -76,11 +101,27 @@ class State(object):
                 self.colors[j] &= ~self.colors[i]
 
     def seed(self, seed=None):
-        self.np_random, seed = seeding.np_random(seed)
+        self._np_random, seed = seeding.np_random(seed)
         return seed
 
+    @property
+    def np_random(self):
+        """Random number generator. Randomly seeded on first use unless seed() is called."""
+        if self._np_random is None:
+            self.seed()
+        return self._np_random
+
+    @np_random.setter
+    def np_random(self, value):
+        self._np_random = value
+
     def clone(self):
-        other = State()
+        """Copy of the state with a fresh random number generator"""
+        other = object.__new__(self.__class__)
+        other._np_random = None
+        other.profiler = self.profiler
+        if self.profiler is not None:
+            self.profiler.clones += 1
         other.scoring_method = self.scoring_method
         other.height = self.height
         other.num_colors = self.num_colors
@@ -91,6 +132,75 @@ class State(object):
         other.chain_number = self.chain_number
         return other
 
+    def serialize(self):
+        """
+        Compact byte string holding the complete state including the state of the random number generator.
+        The generator is left out if it hasn't been created yet.
+        """
+        flags = 0 if self._np_random is None else _HAS_RANDOM
+        header = _HEADER.pack(
+            _SERIAL_VERSION, flags, SCORING_METHODS.index(self.scoring_method), self.height, self.num_colors
+        )
+        chunks = [header, struct.pack("<I", self.chain_number)]
+        for panels in self.features:
+            chunks.append(_PANELS.pack(panels & _LOW, panels >> 64))
+        if flags & _HAS_RANDOM:
+            _, keys, position, has_gauss, cached_gaussian = self._np_random.get_state()
+            chunks.append(_RANDOM.pack(*(list(keys) + [position, has_gauss, cached_gaussian])))
+        return b"".join(chunks)
+
+    @classmethod
+    def deserialize(cls, data):
+        """Inverse of serialize"""
+        version, flags, scoring_method, height, num_colors = _HEADER.unpack_from(data)
+        if version != _SERIAL_VERSION:
+            raise ValueError("Unknown serialization version {}".format(version))
+        instance = object.__new__(cls)
+        instance.scoring_method = SCORING_METHODS[scoring_method]
+        instance.height = height
+        instance.num_colors = num_colors
+        offset = _HEADER.size
+        instance.chain_number, = struct.unpack_from("<I", data, offset)
+        offset += 4
+        features = []
+        for _ in range(num_colors + 3):
+            low, high = _PANELS.unpack_from(data, offset)
+            features.append(low | (high << 64))
+            offset += _PANELS.size
+        instance.colors = features[:num_colors]
+        instance.falling, instance.chaining, instance.swapping = features[num_colors:]
+        instance._np_random = None
+        instance.profiler = None
+        if flags & _HAS_RANDOM:
+            values = _RANDOM.unpack_from(data, offset)
+            instance._np_random = np.random.RandomState()
+            instance._np_random.set_state(("MT19937", np.array(values[:624], dtype="uint32")) + values[624:])
+        return instance
+
+    @property
+    def key(self):
+        """Integer uniquely identifying the dimensions, bitboards and chain number of the state"""
+        key = (((self.chain_number << 8) | self.height) << 8) | self.num_colors
+        for panels in self.colors:
+            key = (key << NUM_BLOCKS) | panels
+        key = (key << NUM_BLOCKS) | self.falling
+        key = (key << NUM_BLOCKS) | self.swapping
+        return (key << NUM_BLOCKS) | self.chaining
+
+    def __eq__(self, other):
+        if not isinstance(other, State):
+            return NotImplemented
+        return self.key == other.key
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self.key)
+
     @property
     def empty(self):
         empty = FULL
@@ -99,38 +209,11 @@ class State(object):
         return empty
 
     def render(self, outfile=sys.stdout):
-        for i in range(self.height):
-            for j in range(WIDTH):
-                p = 1 << (j + i * WIDTH)
-                empty = True
-                for k, panels in enumerate(self.colors):
-                    if p & panels:
-                        print_color(
-                            k + 1,
-                            bright=bool(p & self.chaining),
-                            outfile=outfile
-                        )
-                        empty = False
-                if empty:
-                    if p & self.swapping:
-                        outfile.write("\u2015")
-                    else:
-                        outfile.write("\u00b7")
-                elif p & self.falling:
-                    if p & self.swapping:
-                        outfile.write("\u25a5")
-                    else:
-                        outfile.write("\u25a1")
-                elif p & self.swapping:
-                    outfile.write("\u25a4")
-                else:
-                    outfile.write("\u25a3")
-                outfile.write(" ")
-                print_reset(outfile=outfile)
-            outfile.write("\n")
-        outfile.write("chain={}\n".format(self.chain_number))
+        outfile.write(render_frame(self))
 
     def swap(self, index):
+        if _native is not None:
+            return _native.swap(self, index)
         protected = self.swapping & up(self.empty)
         self.swapping = 0
         if index is None:
@@ -158,18 +241,28 @@ class State(object):
             self.swapping = ~mask
 
     def drop_one(self):
+        if _native is not None:
+            return _native.drop_one(self)
         self.falling = 0
         empty = self.empty
-        row = TOP << (WIDTH * (self.height - 1))
         protected = self.swapping
+        # Empty cells on the board with an unprotected panel above them
+        targets = down((FULL ^ empty) & ~protected) & empty & ~self.swapping & ((1 << (WIDTH * self.height)) - 1)
+        if not targets:
+            return
         empty &= ~self.swapping  # Air support needed for lateslips
-        for i in range(self.height - 1):
-            falling = down(self.chaining & ~protected) & row & empty
+        # Only the columns above a target are affected starting from the lowest target
+        lowest = (targets.bit_length() - 1) // WIDTH
+        affected = beam_up(targets)
+        row = TOP << (WIDTH * lowest)
+        for i in range(lowest):
+            cells = row & affected
+            falling = down(self.chaining & ~protected) & cells & empty
             self.chaining |= falling
             self.chaining ^= up(falling)
             for j in range(self.num_colors):
                 panels = self.colors[j]
-                falling = down(panels & ~protected) & row & empty
+                falling = down(panels & ~protected) & cells & empty
                 self.falling |= falling
                 panels |= falling
                 falling = up(falling)
@@ -179,6 +272,8 @@ class State(object):
             row = up(row)
 
     def clear_matches(self):
+        if _native is not None:
+            return _native.clear_matches(self)
         score = 0
         chain_beam = 0
         protected = self.falling | self.swapping
@@ -217,15 +312,40 @@ class State(object):
         for panels in self.colors:
             if panels & TOP:
                 return
-        while True:
-            row = [self.np_random.randint(0, self.num_colors) for i in range(WIDTH)]
-            temp = self.clone()
-            temp._insert_row(row)
-            if not temp.clear_matches()[0]:
-                break
-        self._insert_row(row)
+        forbidden = forbidden_colors(self.colors, self.falling | self.swapping, self.height)
+        self._insert_row(sample_row(self.np_random, forbidden, self.num_colors))
+
+    def _profiled_step(self, action):
+        profiler = self.profiler
+        timer = profiler.timer
+        profiler.steps += 1
+        start = timer()
+        if action is RAISE_STACK:
+            self.swapping = 0
+        else:
+            self.swap(action)
+        end = timer()
+        profiler.add("swap", end - start)
+        self.drop_one()
+        start = timer()
+        profiler.add("drop_one", start - end)
+        result = self.clear_matches()
+        end = timer()
+        profiler.add("clear_matches", end - start)
+        if action is RAISE_STACK:
+            for panels in self.colors:
+                if panels & TOP:
+                    profiler.raises_blocked += 1
+                    break
+            self.raise_stack()
+            profiler.add("raise_stack", timer() - end)
+        return self.calculate_score(result)
 
     def step(self, action):
+        if self.profiler is not None:
+            return self._profiled_step(action)
+        if action is not RAISE_STACK and _native is not None:
+            return self.calculate_score(_native.step(self, action))
         if action is RAISE_STACK:
             self.swapping = 0
         else:
@@ -236,19 +356,30 @@ class State(object):
             self.raise_stack()
         return self.calculate_score(result)
 
-    def encode(self):
-        np_state = np.zeros((self.num_colors + 3, self.height, WIDTH))
+    @property
+    def features(self):
         features = self.colors[:]
         features.append(self.falling)
         features.append(self.chaining)
         features.append(self.swapping)
-        for i, feature in enumerate(features):
-            p = 1
-            for j in range(self.height):
-                for k in range(WIDTH):
-                    np_state[i][j][k] = bool(p & feature)
-                    p <<= 1
-        return np_state
+        return features
+
+    def encode(self, out=None, dtype="float"):
+        """
+        Dense (num_colors + 3, height, WIDTH) encoding of the state.
+        Written into out if given in which case dtype is taken from out.
+        """
+        rows = panels_to_rows(self.features, self.height)
+        if out is None:
+            return row_table(dtype)[rows]
+        return row_table(out.dtype).take(rows, axis=0, out=out, mode="clip")
+
+    def encode_packed(self, out=None):
+        """
+        Compact (num_colors + 3, 2) uint64 encoding of the state.
+        Each feature is split into the top and bottom six rows, one 36 bit row-major word each.
+        """
+        return panels_to_halves(self.features, out=out)
 
     def calculate_score(self, result):
         if self.scoring_method is None:
@@ -261,6 +392,32 @@ class State(object):
                 return self.chain_number
             return 0
 
+    def get_action_mask(self):
+        """
+        Boolean vector over the actions of the state marking the ones that can change the board.
+        Masked actions have the same effect as doing nothing. Those are swaps that are blocked by
+        a panel swapping over a gap and swaps of two empty cells.
+        Swapping two panels of the same color is allowed since it protects them from matching and falling.
+        Raising the stack is masked out when the top row stays occupied after this step's drop and clear,
+        i.e. when a top row panel is supported all the way down and isn't part of a match.
+        """
+        mask = np.ones(2 + (WIDTH - 1) * self.height, dtype=bool)
+        empty = self.empty
+        protected = self.swapping & up(empty)
+        ineffective = protected | left(protected) | (empty & left(empty))
+        if TOP & ~empty:
+            # Raising clears the swapping flags so every panel above a gap falls and only resting panels match
+            resting = (FULL ^ empty) & ~beam_up(empty & ((1 << (WIDTH * self.height)) - 1))
+            if TOP & resting:
+                matches = 0
+                for panels in self.colors:
+                    matches |= get_matches(panels & resting)
+                if TOP & resting & ~matches:
+                    mask[1] = False
+        cells = row_table("bool")[panels_to_rows([FULL ^ ineffective], self.height)[0]]
+        mask[2:] = cells[:, :WIDTH - 1].ravel()
+        return mask
+
     def get_children(self):
         result = []
         for i in range(2 + (WIDTH - 1) * self.height):
@@ -0,0 +1,205 @@
+"""
+Benchmarks the hot paths of the environment and reports the results as JSON.
+
+Usage: python misc/benchmark.py [--min-time SECONDS] [--output FILE] [--compare BASELINE]
+"""
+import argparse
+import json
+import platform
+import sys
+from timeit import default_timer
+
+import numpy as np
+
+from gym_paneldepon import state as state_module
+from gym_paneldepon.bitboard import WIDTH
+from gym_paneldepon.env import PdPEndlessEnv
+from gym_paneldepon.sliced import SlicedState
+from gym_paneldepon.state import ACTIONS, State
+
+SEED = 1234
+EPISODE_LENGTH = 200
+
+CONFIGS = {
+    "PdPEndless-v0": {"height": 12, "num_colors": 6},
+    "PdPEndless4-v0": {"height": 4, "num_colors": 3},
+}
+
+_ = None
+R = 0
+G = 1
+Y = 2
+B = 3
+P = 4
+C = 5
+
+CHAIN_STACKS = {
+    "PdPEndless-v0": [
+        R, _, _, _, _, _,
+        R, _, _, _, _, _,
+        G, B, B, _, _, _,
+        G, B, B, _, _, _,
+        G, G, G, _, _, _,
+        R, B, B, _, _, _,
+        Y, P, C, R, G, B,
+        R, G, B, Y, P, C,
+    ],
+    "PdPEndless4-v0": [
+        _, G, _, _, _, _,
+        _, R, _, _, _, _,
+        G, R, _, _, _, _,
+        G, R, _, _, _, _,
+    ],
+}
+
+
+def raised_state(config, rows):
+    state = State(scoring_method="endless", **CONFIGS[config])
+    state.seed(SEED)
+    for _ in range(rows):
+        state.raise_stack()
+    return state
+
+
+def chain_state(config):
+    height = CONFIGS[config]["height"]
+    stack = CHAIN_STACKS[config]
+    stack = [None] * (WIDTH * height - len(stack)) + stack
+    state = State.from_list(stack, num_colors=CONFIGS[config]["num_colors"])
+    state.scoring_method = "endless"
+    return state
+
+
+def corpus(config):
+    height = CONFIGS[config]["height"]
+    return {
+        "empty": raised_state(config, 0),
+        "half": raised_state(config, height // 2),
+        "full": raised_state(config, height - 1),
+        "chain": chain_state(config),
+    }
+
+
+def measure(function, min_time):
+    """Calls function until min_time has passed. Returns operations per second."""
+    operations = 0
+    start = default_timer()
+    elapsed = 0
+    while elapsed < min_time:
+        operations += function()
+        elapsed = default_timer() - start
+    return operations / elapsed
+
+
+def bench_step(state, min_time):
+    np_random = np.random.RandomState(SEED)
+    actions = [ACTIONS[a] for a in np_random.randint(0, 2 + (WIDTH - 1) * state.height, size=EPISODE_LENGTH)]
+
+    def run():
+        episode = state.clone()
+        episode.seed(SEED)
+        for action in actions:
+            episode.step(action)
+        return len(actions)
+    return measure(run, min_time)
+
+
+def bench_python_step(state, min_time):
+    """Steps per second without the native extension"""
+    native = state_module._native
+    state_module._native = None
+    try:
+        return bench_step(state, min_time)
+    finally:
+        state_module._native = native
+
+
+def bench_sliced_step(state, min_time):
+    return bench_step(SlicedState.from_state(state), min_time)
+
+
+def bench_encode(state, min_time):
+    def run():
+        for _ in range(100):
+            state.encode()
+        return 100
+    return measure(run, min_time)
+
+
+def bench_clone(state, min_time):
+    def run():
+        for _ in range(100):
+            state.clone()
+        return 100
+    return measure(run, min_time)
+
+
+def bench_children(state, min_time):
+    def run():
+        return len(state.get_children())
+    return measure(run, min_time)
+
+
+def bench_tree(config, state, min_time):
+    env = PdPEndlessEnv(**CONFIGS[config])
+    env.state = state.clone()
+
+    def run():
+        return len(env.get_tree())
+    return measure(run, min_time)
+
+
+def run_benchmarks(min_time=0.2):
+    results = {}
+    for config in sorted(CONFIGS):
+        results[config] = {}
+        for name, state in sorted(corpus(config).items()):
+            results[config][name] = {
+                "steps_per_sec": bench_step(state, min_time),
+                "python_steps_per_sec": bench_python_step(state, min_time),
+                "sliced_steps_per_sec": bench_sliced_step(state, min_time),
+                "encodes_per_sec": bench_encode(state, min_time),
+                "clones_per_sec": bench_clone(state, min_time),
+                "children_nodes_per_sec": bench_children(state, min_time),
+                "tree_nodes_per_sec": bench_tree(config, state, min_time),
+            }
+    return {
+        "python": platform.python_version(),
+        "native": state_module._native is not None,
+        "seed": SEED,
+        "results": results,
+    }
+
+
+def compare(baseline, report, outfile=sys.stderr):
+    """Prints the speedup of each measurement relative to a baseline report"""
+    for config, corpora in sorted(report["results"].items()):
+        for name, metrics in sorted(corpora.items()):
+            for metric, value in sorted(metrics.items()):
+                try:
+                    reference = baseline["results"][config][name][metric]
+                except KeyError:
+                    continue
+                outfile.write("{} {} {}: {:.2f}x\n".format(config, name, metric, value / reference))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds spent on each measurement")
+    parser.add_argument("--output", help="Write the results to this file instead of stdout")
+    parser.add_argument("--compare", help="Report speedups relative to the results in this file")
+    args = parser.parse_args(argv)
+    report = run_benchmarks(args.min_time)
+    if args.compare:
+        with open(args.compare) as infile:
+            compare(json.load(infile), report)
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(report, outfile, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
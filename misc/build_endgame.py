@@ -0,0 +1,27 @@
+"""
+Builds an endgame table for PdPEndless4-v0 from random raised stacks.
+
+Usage: python misc/build_endgame.py OUTPUT [--roots N] [--depth K] [--max-positions N] [--seed SEED]
+"""
+import argparse
+import sys
+
+from gym_paneldepon.endgame import EndgameTable, build_table, random_roots
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("output", help="Table file to write")
+    parser.add_argument("--roots", type=int, default=1000, help="Number of random roots")
+    parser.add_argument("--depth", type=int, default=3, help="Number of moves to look ahead")
+    parser.add_argument("--max-positions", type=int, default=1000000, help="Stop solving roots after this many")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    roots = random_roots(args.roots, height=4, num_colors=3, seed=args.seed)
+    solved = build_table(args.output, roots, args.depth, args.max_positions)
+    table = EndgameTable(args.output)
+    sys.stdout.write("Solved {} roots, {} positions\n".format(solved, len(table)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
+import sys
 from time import sleep
 
-from gym_paneldepon.bitboard import HEIGHT
+from gym_paneldepon.render import FrameDiffer
 from gym_paneldepon.state import ACTIONS, RAISE_STACK, State
 from gym_paneldepon.util import print_up
 
@@ -11,7 +12,8 @@ def random_demo():
     print("Random play using seed={}".format(seed))
     for i in range(12):
         state.raise_stack()
-    state.render()
+    differ = FrameDiffer()
+    sys.stdout.write(differ.diff(state))
     print()
     max_chain = 0
     total = 0
@@ -22,8 +24,8 @@ def random_demo():
             action = RAISE_STACK
         total += state.step(action)[0]
         sleep(0.1)
-        print_up(HEIGHT + 2)
-        state.render()
+        print_up(1)
+        sys.stdout.write(differ.diff(state))
         max_chain = max(state.chain_number, max_chain)
         print("score={} max chain={}".format(total, max_chain))
 
@@ -1,7 +1,26 @@
+import sys
+
 import setuptools
+from setuptools.command.build_py import build_py
+
+# Modules using async syntax. They are left out of installs on older Pythons where they can't be compiled.
+PY35_MODULES = ("client", "server")
+
+
+class BuildPy(build_py):
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 5):
+            modules = [module for module in modules if module[:2] not in [(package, name) for name in PY35_MODULES]]
+        return modules
+
 
 if __name__ == '__main__':
     setuptools.setup(
         setup_requires=['setuptools>=34.0', 'setuptools-gitver'],
-        gitver=True
+        gitver=True,
+        cmdclass={"build_py": BuildPy},
+        ext_modules=[
+            setuptools.Extension("gym_paneldepon._native", ["gym_paneldepon/_native.c"], optional=True),
+        ],
     )
@@ -0,0 +1,6 @@
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    # Uses async syntax which doesn't compile on older Pythons
+    collect_ignore.append("test_server.py")
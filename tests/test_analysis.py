@@ -0,0 +1,101 @@
+import numpy as np
+
+from gym_paneldepon.analysis import evaluate, settle, unsupported
+from gym_paneldepon.bitboard import WIDTH, down
+from gym_paneldepon.state import ACTIONS, State
+
+_ = None
+R = 0
+G = 1
+Y = 2
+B = 3
+P = 4
+C = 5
+
+
+def test_settle():
+    stack = [
+        R, _, _, _, _, _,
+        _, _, _, _, _, _,
+        G, B, _, _, _, _,
+        _, _, _, _, _, _,
+        Y, _, _, _, _, P,
+    ]
+    state = State.from_list(stack)
+    assert unsupported(state.colors[R] | state.colors[G] | state.colors[B], state.height) == \
+        state.colors[R] | state.colors[G] | state.colors[B]
+    colors, chaining = settle(state.colors, state.colors[R], state.height)
+    settled = State.from_list([
+        _, _, _, _, _, _,
+        _, _, _, _, _, _,
+        R, _, _, _, _, _,
+        G, _, _, _, _, _,
+        Y, B, _, _, _, P,
+    ], num_colors=state.num_colors)
+    assert colors == settled.colors
+    assert chaining == settled.colors[R]
+
+
+def test_settle_deep_gaps():
+    np_random = np.random.RandomState(1)
+    for _ in range(300):
+        height = np_random.randint(1, 13)
+        cells = np.where(np_random.rand(WIDTH * height) < 0.6, np_random.randint(0, 4, WIDTH * height), -1)
+        colors = [sum(1 << i for i in range(WIDTH * height) if cells[i] == color) for color in range(4)]
+        occupied = colors[0] | colors[1] | colors[2] | colors[3]
+        chaining = occupied & sum(1 << i for i in range(WIDTH * height) if np_random.rand() < 0.3)
+        expected = colors[:]
+        expected_chaining = chaining
+        floating = unsupported(occupied, height)
+        while floating:
+            expected = [(panels & ~floating) | down(panels & floating) for panels in expected]
+            expected_chaining = (expected_chaining & ~floating) | down(expected_chaining & floating)
+            occupied = (occupied & ~floating) | down(occupied & floating)
+            floating = unsupported(occupied, height)
+        assert settle(colors, chaining, height) == (expected, expected_chaining)
+
+
+def test_chain():
+    stack = [
+        R, _, _, _, _, _,
+        R, _, _, _, _, _,
+        G, B, B, _, _, _,
+        G, B, B, _, _, _,
+        G, G, G, _, _, _,
+        R, B, B, _, _, _,
+        Y, P, C, R, G, B,
+        R, G, B, Y, P, C,
+    ]
+    state = State.from_list(stack)
+    before = state.clone()
+    report = evaluate(state)
+    assert state == before
+    assert report.chain_number == 2
+    assert report.chain_length == 3
+    assert report.links == (5, 6, 3)
+    assert report.settled.to_list()[-2 * WIDTH:] == stack[-2 * WIDTH:]
+
+
+def test_matches_step():
+    np_random = np.random.RandomState(0)
+    for seed in range(200):
+        state = State(height=8, num_colors=4)
+        state.seed(seed)
+        for _ in range(np_random.randint(1, 8)):
+            state.raise_stack()
+        for _ in range(np_random.randint(0, 30)):
+            state.step(ACTIONS[np_random.randint(0, 2 + 5 * state.height)])
+        report = evaluate(state)
+        links = []
+        best = state.chain_number
+        length = 0
+        for _ in range(100):
+            score, combo = state.step(None)
+            if combo:
+                links.append(combo)
+                best = max(best, score - 1)
+                length = max(length, score)
+        assert report.links == tuple(links)
+        assert report.chain_number == best
+        assert report.chain_length == length
+        assert report.settled.colors == state.colors
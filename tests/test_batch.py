@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from gym_paneldepon import batch
+from gym_paneldepon.batch import RAISE_ACTION, BatchState
+from gym_paneldepon.bitboard import FULL, RIGHT_BLOCK, WIDTH
+from gym_paneldepon.state import ACTIONS, State
+
+_ = None
+R = 0
+G = 1
+B = 3
+
+
+def assert_same(state, other):
+    assert state.colors == other.colors
+    assert state.falling == other.falling
+    assert state.swapping == other.swapping
+    assert state.chaining == other.chaining
+    assert state.chain_number == other.chain_number
+
+
+def test_split_join():
+    panels = 12345 | (987 << 50) | (1 << 71)
+    assert batch.join(batch.split(panels)) == panels
+
+
+@pytest.mark.parametrize("panels", [1, 1 << 30, 1 << 35, 1 << 36, 7 << 40, FULL])
+def test_shifts(panels):
+    halves = batch.split(panels)
+    assert batch.join(batch.left(halves)) == (panels & RIGHT_BLOCK) >> 1
+    assert batch.join(batch.right(halves)) == (panels << 1) & RIGHT_BLOCK
+    assert batch.join(batch.up(halves)) == panels >> WIDTH
+    assert batch.join(batch.down(halves)) == (panels << WIDTH) & FULL
+
+
+def test_popcount():
+    halves = np.array([batch.split(FULL), batch.split(0), batch.split(1 | (1 << 70))])
+    assert list(batch.popcount(halves)) == [72, 0, 2]
+
+
+def test_late_slip():
+    stack = [
+        _, R, _, _, _, _,
+        R, B, _, _, _, _,
+        G, G, R, _, _, _,
+        B, G, B, _, _, _,
+        G, G, B, _, _, _,
+    ]
+    state = State.from_list(stack)
+    idle = state.clone()
+    states = BatchState.from_states([state, idle])
+    total = 0
+    idle_total = 0
+    for i in range(8):
+        actions = [0, 0]
+        if i == 3:
+            actions[0] = ACTIONS.index((state.height - 1) * WIDTH)
+        total += states.step(actions)[0]
+        idle_total += idle.step(None)[0]
+    assert list(total) == [6, idle_total]
+
+
+@pytest.mark.parametrize("height,num_colors", [(12, 6), (4, 3), (7, 5)])
+def test_random_play(height, num_colors):
+    np_random = np.random.RandomState(height)
+    states = []
+    for i in range(16):
+        state = State(scoring_method="endless", height=height, num_colors=num_colors)
+        state.seed(i)
+        for _ in range(np_random.randint(0, height + 1)):
+            state.raise_stack()
+        states.append(state)
+    batch_state = BatchState.from_states(states)
+    for _ in range(50):
+        actions = np_random.randint(2, 2 + (WIDTH - 1) * height, size=len(states))
+        actions[np_random.randint(0, 2, size=len(states)) == 0] = 0
+        scores = batch_state.step(actions)
+        observations = batch_state.encode()
+        for i, state in enumerate(states):
+            assert state.step(ACTIONS[actions[i]]) == scores[i]
+            assert_same(state, batch_state.get_state(i))
+            assert (state.encode() == observations[i]).all()
+
+
+def test_raise_stack():
+    states = BatchState(8)
+    for i in range(states.height):
+        states.step([RAISE_ACTION] * states.batch_size)
+    for i in range(10):
+        states.step([0] * states.batch_size)
+    for i in range(states.batch_size):
+        state = states.get_state(i)
+        all_panels = 0
+        for panels in state.colors:
+            all_panels |= panels
+        assert all_panels == FULL
+        assert state.clear_matches() == (0, 0)
+
+
+def test_swap_off_screen():
+    states = BatchState(2)
+    with pytest.raises(ValueError):
+        states.swap([-1, WIDTH - 1])
+
+
+def test_drop_one_settled_short_board(monkeypatch):
+    stack = [
+        _, _, _, _, _, _,
+        _, R, _, _, _, _,
+        G, B, _, _, _, _,
+        R, G, B, R, G, B,
+    ]
+    state = State.from_list(stack)
+    assert state.height == 4
+    states = BatchState.from_states([state, state])
+
+    def row_mask(y):
+        raise AssertionError("A settled board should skip the gravity loop")
+
+    monkeypatch.setattr(batch, "row_mask", row_mask)
+    states.drop_one()
+    assert not states.falling.any()
+    for i in range(states.batch_size):
+        assert_same(states.get_state(i), state)
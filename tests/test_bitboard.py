@@ -43,3 +43,34 @@ def test_to_list():
         0, 0, 0, 0, 0, 0
     ]
     assert list(map(int, bitboard.panels_to_list(12345))) == result
+
+
+def test_popcount():
+    assert bitboard.popcount(0) == 0
+    assert bitboard.popcount(12345) == 6
+    assert bitboard.popcount(bitboard.FULL) == bitboard.NUM_BLOCKS
+
+
+def test_to_rows():
+    rows = bitboard.panels_to_rows([12345, bitboard.BOTTOM], height=3)
+    assert rows.tolist() == [[57, 0, 3], [0, 0, 0]]
+    assert bitboard.panels_to_rows([bitboard.BOTTOM]).tolist() == [[0] * 11 + [63]]
+    assert bitboard.ROW_TABLE[57].tolist() == [1, 0, 0, 1, 1, 1]
+
+
+def test_columns():
+    assert bitboard.to_columns(bitboard.TOP) == sum(1 << (x * bitboard.HEIGHT) for x in range(bitboard.WIDTH))
+    assert bitboard.to_columns(bitboard.LEFT_WALL) == bitboard.LANE
+    assert bitboard.to_columns(bitboard.dot(2, 3)) == 1 << (3 + 2 * bitboard.HEIGHT)
+    for panels in (0, 12345, bitboard.FULL, bitboard.BOTTOM, 0x123456789abcdef012):
+        assert bitboard.from_columns(bitboard.to_columns(panels)) == panels
+
+
+def test_compaction():
+    # Column 0 has panels on rows 0 and 2 above an empty bottom row. Column 1 is already resting.
+    occupied = bitboard.dot(0, 0) | bitboard.dot(0, 2) | bitboard.dot(1, 3)
+    groups = bitboard.compaction_groups(occupied, height=4)
+    assert groups == [(1, bitboard.dot(0, 2)), (2, bitboard.dot(0, 0))]
+    assert bitboard.compact(occupied, groups) == bitboard.dot(0, 2) | bitboard.dot(0, 3) | bitboard.dot(1, 3)
+    assert bitboard.compact(bitboard.dot(0, 0), groups) == bitboard.dot(0, 2)
+    assert bitboard.compaction_groups(bitboard.BOTTOM) == []
@@ -0,0 +1,76 @@
+import numpy as np
+
+from gym_paneldepon.batch import RAISE_ACTION
+from gym_paneldepon.bitboard import WIDTH
+from gym_paneldepon.cache import StepCache
+from gym_paneldepon.env import PdPEndlessEnv
+from gym_paneldepon.state import ACTIONS, RAISE_STACK, State
+
+
+def test_matches_step():
+    cache = StepCache()
+    np_random = np.random.RandomState(0)
+    for _ in range(3):
+        state = State(scoring_method="endless", height=4, num_colors=3)
+        state.seed(1)
+        for _ in range(3):
+            state.raise_stack()
+        for _ in range(100):
+            action = ACTIONS[np_random.randint(2, 2 + (WIDTH - 1) * state.height)]
+            reference = state.clone()
+            assert cache.step(state, action) == reference.step(action)
+            assert state == reference
+    assert cache.hits
+    assert cache.misses
+    assert cache.info()["entries"] == len(cache) == cache.misses
+
+
+def test_raise_not_cached():
+    cache = StepCache()
+    state = State()
+    cache.step(state, RAISE_STACK)
+    assert state.colors != [0] * state.num_colors
+    assert not len(cache)
+    assert cache.info()["hits"] == cache.info()["misses"] == 0
+
+
+def test_eviction():
+    cache = StepCache(max_entries=2)
+    states = [State() for _ in range(3)]
+    for i, state in enumerate(states):
+        state.colors[0] = 1 << (6 * i)
+        cache.step(state.clone(), None)
+    assert len(cache) == 2
+    cache.step(states[0].clone(), None)
+    assert cache.misses == 4
+    cache.step(states[2].clone(), None)
+    assert cache.hits == 1
+    assert len(cache) == 2
+
+    cache = StepCache(max_bytes=1)
+    cache.step(State(), None)
+    assert not len(cache)
+    assert cache.info()["bytes"] == 0
+
+
+def test_env_tree():
+    cache = StepCache()
+    env = PdPEndlessEnv(height=4, num_colors=3)
+    cached_env = PdPEndlessEnv(height=4, num_colors=3, cache=cache)
+    env.seed(2)
+    cached_env.seed(2)
+    env.reset()
+    cached_env.reset()
+    for _ in range(3):
+        env.step(RAISE_ACTION)
+        cached_env.step(RAISE_ACTION)
+    for _ in range(2):
+        tree = env.get_game_tree(2)
+        cached_tree = cached_env.get_game_tree(2)
+        # Raising the stack is random so only the deterministic children are compared
+        children = np.delete(tree.children[0], RAISE_ACTION)
+        cached_children = np.delete(cached_tree.children[0], RAISE_ACTION)
+        assert (np.delete(tree.rewards[0], RAISE_ACTION) == np.delete(cached_tree.rewards[0], RAISE_ACTION)).all()
+        assert (tree.observations[children] == cached_tree.observations[cached_children]).all()
+        assert (tree.rewards[children] == cached_tree.rewards[cached_children]).all()
+    assert cache.hits
@@ -0,0 +1,70 @@
+from gym_paneldepon.endgame import UNKNOWN, EndgameTable, build_table, canonical_hash, mirror, random_roots, solve
+from gym_paneldepon.state import ACTIONS, RAISE_STACK, State
+
+_ = None
+R = 0
+G = 1
+B = 2
+
+
+def brute_force(state, depth):
+    best = 0
+    if not depth:
+        return best
+    for action in ACTIONS[:2 + 5 * state.height]:
+        if action is RAISE_STACK:
+            continue
+        child = state.clone()
+        reward = child.step(action)
+        best = max(best, reward, brute_force(child, depth - 1))
+    return best
+
+
+def test_mirror():
+    state = random_roots(1, seed=3)[0]
+    state.swapping = 3
+    flipped = mirror(state)
+    assert flipped != state
+    assert mirror(flipped) == state
+    assert canonical_hash(flipped) == canonical_hash(state)
+
+
+def test_solve():
+    stack = [
+        _, _, _, _, _, _,
+        _, R, _, _, _, _,
+        G, R, _, _, _, _,
+        R, G, B, B, _, _,
+    ]
+    state = State.from_list(stack)
+    state.scoring_method = "endless"
+    solver, solved = solve([state], 3)
+    assert solved == 1
+    values = solver.values[canonical_hash(state)]
+    assert values == [brute_force(state, k) for k in (1, 2, 3)]
+    assert values[0] == 0
+    assert values[2] > 0
+
+
+def test_table(tmpdir):
+    path = str(tmpdir.join("endgame.bin"))
+    roots = random_roots(6, seed=1)
+    assert build_table(path, roots, 2, max_positions=1) == 1
+    assert build_table(path, roots, 2) == 6
+    table = EndgameTable(path)
+    assert table.depth == 2
+    for root in roots:
+        assert list(table.lookup(root)) == [brute_force(root, 1), brute_force(root, 2)]
+        assert table.value(mirror(root), 2) == brute_force(root, 2)
+    # Positions first reached with one move to spare only know their one move value
+    partial = 0
+    for action in ACTIONS[2:2 + 5 * 4]:
+        child = roots[0].clone()
+        child.step(action)
+        assert table.value(child, 1) == brute_force(child, 1)
+        if table.lookup(child)[1] == UNKNOWN:
+            assert table.value(child, 2) is None
+            partial += 1
+    assert partial
+    assert table.lookup(State(height=4, num_colors=3)) is None
+    assert table.lookup(State()) is None
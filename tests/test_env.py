@@ -2,7 +2,7 @@ import numpy as np
 import pytest
 from gym.envs.registration import make
 
-from gym_paneldepon.env import register
+from gym_paneldepon.env import PdPEndlessEnv, PdPEndlessVecEnv, register
 
 register()
 
@@ -104,3 +104,155 @@ def test_tree_search():
     for _ in range(5):
         env.step(agent())
         env.render(mode="human")
+
+
+def test_vec_env():
+    env = make("PdPEndlessVec-v0")
+    num_envs = env.unwrapped.num_envs
+    chain_numbers, observations = env.reset()
+    assert chain_numbers.shape == (num_envs,)
+    for _ in range(12):
+        env.step(np.ones(num_envs, dtype=int))
+    for _ in range(50):
+        actions = np.array([env.action_space.sample() for _ in range(num_envs)])
+        (chain_numbers, observations), rewards, dones, _info = env.step(actions)
+        assert rewards.shape == (num_envs,)
+        assert dones.shape == (num_envs,)
+        for chain_number, observation in zip(chain_numbers, observations):
+            assert env.observation_space.contains((chain_number, observation))
+        for reward in rewards:
+            assert env.reward_range[0] <= reward <= env.reward_range[-1]
+    env.render(mode="ansi")
+
+
+def test_vec_env_auto_reset():
+    env = PdPEndlessVecEnv(num_envs=3, height=4, num_colors=3, max_chain=8, max_episode_steps=5)
+    env.reset()
+    env.step([1, 1, 1])
+    env.step([1, 1, 1])
+    env.elapsed_steps[0] = 0
+    for _ in range(2):
+        _observation, _rewards, dones, _info = env.step([0, 0, 0])
+        assert not dones.any()
+    (chain_numbers, observations), _rewards, dones, _info = env.step([0, 0, 0])
+    assert list(dones) == [False, True, True]
+    assert not observations[1:].any()
+    assert list(env.elapsed_steps) == [3, 0, 0]
+
+
+@pytest.mark.parametrize("encoding", ["float32", "uint8", "bool", "packed"])
+def test_encodings(encoding):
+    env = PdPEndlessEnv(height=4, num_colors=3, max_chain=8, encoding=encoding)
+    reference = PdPEndlessEnv(height=4, num_colors=3, max_chain=8)
+    env.reset()
+    for _ in range(4):
+        env.step(1)
+    for _ in range(20):
+        action = env.action_space.sample()
+        observation, _reward, _done, info = env.step(action)
+        assert env.observation_space.contains(observation)
+        expected = reference.encode(info["state"])
+        if encoding == "packed":
+            features = [int(low) | (int(high) << 36) for low, high in observation[1]]
+            assert features == info["state"].features
+        else:
+            assert observation[1].dtype == np.dtype(encoding)
+            assert (observation[1] == expected).all()
+    for observation, _reward in env.get_tree():
+        assert env.observation_space.contains(observation)
+
+
+@pytest.mark.parametrize("encoding", ["uint8", "packed"])
+def test_vec_env_encodings(encoding):
+    env = PdPEndlessVecEnv(num_envs=4, encoding=encoding)
+    env.reset()
+    for _ in range(6):
+        (_chain_numbers, observations), _rewards, _dones, _info = env.step([1] * 4)
+    for i in range(env.num_envs):
+        state = env.state.get_state(i)
+        if encoding == "packed":
+            assert (observations[i] == state.encode_packed()).all()
+        else:
+            assert (observations[i] == state.encode()).all()
+
+
+def test_encode_into_buffer():
+    env = make("PdPEndless-v0")
+    env.reset()
+    for _ in range(6):
+        env.step(1)
+    state = env.unwrapped.state
+    out = np.zeros((state.num_colors + 3, state.height, 6), dtype="uint8")
+    assert state.encode(out=out) is out
+    assert (out == state.encode()).all()
+
+
+@pytest.mark.parametrize("name", ["PdPEndless-v0", "PdPEndless4-v0"])
+def test_deep_tree(name):
+    env = make(name)
+    env.reset()
+    for _ in range(4):
+        env.step(1)
+    tree = env.unwrapped.get_game_tree(2)
+    num_nodes = len(tree.chain_numbers)
+    assert tree.observations.shape[0] == num_nodes
+    assert tree.children.shape == (num_nodes, env.action_space.n)
+    assert tree.rewards.shape == (num_nodes, env.action_space.n)
+    # Swapping empty cells leads to the same state as doing nothing
+    assert len(set(tree.children[0])) < env.action_space.n
+    assert (tree.children[tree.children[0]] >= 0).all()
+    shallow = env.unwrapped.get_tree(include_observations=False)
+    assert list(shallow[2:]) == list(tree.rewards[0][2:])
+    for child in tree.children[0][2:]:
+        assert env.observation_space.contains((tree.chain_numbers[child], tree.observations[child]))
+
+
+def test_deep_tree_without_observations():
+    env = make("PdPEndless4-v0")
+    env.reset()
+    for _ in range(3):
+        env.step(1)
+    tree = env.unwrapped.get_game_tree(3, include_observations=False)
+    assert tree.observations is None
+    assert len(tree.chain_numbers) == len(tree.children)
+    with pytest.raises(NotImplementedError):
+        env.unwrapped.get_tree(depth=3)
+
+
+def test_profiling():
+    env = PdPEndlessEnv(height=4, num_colors=3)
+    assert env.get_profile() is None
+    env.enable_profiling()
+    env.reset()
+    env.step(1)
+    env.get_tree()
+    profile = env.get_profile()
+    assert profile["steps"] == 1 + env.action_space.n
+    assert profile["clones"] == env.action_space.n
+    assert profile["phases"]["encode"]["calls"] == 2 + env.action_space.n
+    env.enable_profiling(False)
+    assert env.get_profile() is None
+
+
+@pytest.mark.parametrize("encoding", ["float", "packed"])
+def test_tree_batch(encoding):
+    env = PdPEndlessEnv(encoding=encoding)
+    env.reset()
+    for _ in range(6):
+        env.step(1)
+    for action in (10, 11, 0):
+        env.step(action)
+    batch = env.get_tree_batch()
+    tree = env.get_tree()
+    assert batch.observations.shape == (env.action_space.n,) + env.observation_space.spaces[1].shape
+    for action, ((chain_number, observation), reward) in enumerate(tree):
+        if action == 1:
+            continue
+        assert batch.chain_numbers[action] == chain_number
+        assert batch.rewards[action] == reward
+        assert (batch.observations[action] == observation).all()
+    assert (batch.mask == env.get_action_mask()).all()
+    env.step(20)
+    again = env.get_tree_batch(include_mask=False)
+    assert again.mask is None
+    assert again.observations is batch.observations
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from gym_paneldepon.mcts import MCTS, RAISE_ACTION, ChanceNode
+from gym_paneldepon.state import ACTIONS, State
+
+_ = None
+R = 0
+G = 1
+Y = 2
+B = 3
+P = 4
+C = 5
+
+
+@pytest.fixture
+def chain_state():
+    stack = [
+        G, _, _, _, _, _,
+        R, _, _, _, Y, P,
+        R, B, B, Y, P, C,
+        R, G, G, B, Y, P,
+    ]
+    state = State.from_list(stack)
+    state.scoring_method = "endless"
+    return state
+
+
+class RecordingEvaluator(object):
+    def __init__(self, raise_prior=1.0):
+        self.raise_prior = raise_prior
+        self.batch_sizes = []
+
+    def __call__(self, chain_numbers, observations):
+        self.batch_sizes.append(len(observations))
+        assert len(chain_numbers) == len(observations)
+        priors = np.ones((len(observations), 2 + 5 * observations.shape[2]))
+        priors[:, RAISE_ACTION] = self.raise_prior
+        return priors, np.zeros(len(observations))
+
+
+def test_batches_leaves(chain_state):
+    evaluator = RecordingEvaluator()
+    search = MCTS(chain_state, evaluator, batch_size=16, seed=0)
+    calls = search.search(200)
+    assert calls == len(evaluator.batch_sizes)
+    assert sum(evaluator.batch_sizes) == 200
+    assert max(evaluator.batch_sizes) == 16
+    # Every simulation but the one expanding the root passes through it
+    assert search.root.visits.sum() == 199
+    assert not search.root.visits[~search.root.mask].any()
+    # Swapping the two greens of the bottom row holds them in place so it can be played
+    assert search.root.mask[2 + 3 * 5 + 1]
+    policy = search.get_policy()
+    assert policy.sum() == pytest.approx(1)
+    assert search.best_action() == np.argmax(search.root.visits)
+
+
+def test_finds_chain(chain_state):
+    search = MCTS(chain_state, batch_size=16, seed=1)
+    state = chain_state.clone()
+    total = 0
+    for _ in range(8):
+        search.search(200)
+        action = search.best_action()
+        total += state.step(ACTIONS[action])
+        search.advance(action, state)
+    assert total >= 3
+
+
+def test_reuses_subtree(chain_state):
+    search = MCTS(chain_state, batch_size=8, seed=2)
+    search.search(100)
+    action = search.best_action()
+    child = search.root.children[action]
+    visits = search.root.visits[action]
+    state = chain_state.clone()
+    state.step(ACTIONS[action])
+    search.advance(action, state)
+    assert search.root is child
+    assert search.root.visits.sum() == visits - 1
+    search.advance(0, State(height=4))
+    assert not search.root.expanded
+
+
+def test_raise_is_a_chance_node():
+    state = State.from_list([
+        _, _, _, _, _, _,
+        _, _, _, _, _, _,
+        R, _, _, _, _, _,
+        R, G, G, B, Y, P,
+    ])
+    search = MCTS(state, RecordingEvaluator(raise_prior=1000.0), batch_size=8, seed=3)
+    search.search(100)
+    chance = search.root.children[RAISE_ACTION]
+    assert isinstance(chance, ChanceNode)
+    assert 1 < len(chance.outcomes) <= ChanceNode.max_outcomes
+    assert sum(chance.counts.values()) == search.root.visits[RAISE_ACTION]
+    outcome = next(iter(chance.outcomes.values()))
+    search.advance(RAISE_ACTION, outcome.state.clone())
+    assert search.root is outcome
+
+
+def test_packed_encoding(chain_state):
+    shapes = []
+
+    def evaluator(chain_numbers, observations):
+        shapes.append(observations.shape)
+        return np.ones((len(observations), 1)), np.zeros(len(observations))
+
+    MCTS(chain_state, evaluator, batch_size=4, encoding="packed").search(10)
+    assert shapes[0] == (1, chain_state.num_colors + 3, 2)
+    assert shapes[1] == (4, chain_state.num_colors + 3, 2)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from gym_paneldepon import state as state_module
+from gym_paneldepon.bitboard import WIDTH
+from gym_paneldepon.state import ACTIONS, RAISE_STACK, State
+
+native = state_module._native
+pytestmark = pytest.mark.skipif(native is None, reason="Native extension not built")
+
+
+def assert_same(state, other):
+    assert state.colors == other.colors
+    assert state.falling == other.falling
+    assert state.swapping == other.swapping
+    assert state.chaining == other.chaining
+    assert state.chain_number == other.chain_number
+
+
+@pytest.mark.parametrize("height,num_colors", [(12, 6), (4, 3), (7, 5), (12, 2)])
+def test_random_play(height, num_colors, monkeypatch):
+    np_random = np.random.RandomState(height * num_colors)
+    state = State(scoring_method="endless", height=height, num_colors=num_colors)
+    state.seed(height)
+    for _ in range(height // 2):
+        state.raise_stack()
+    for _ in range(500):
+        action = ACTIONS[np_random.randint(0, 2 + (WIDTH - 1) * height)]
+        if action is RAISE_STACK:
+            state.raise_stack()
+            continue
+        reference = state.clone()
+        score = state.step(action)
+        with monkeypatch.context() as context:
+            context.setattr(state_module, "_native", None)
+            assert reference.step(action) == score
+        assert_same(state, reference)
+
+
+def test_parts(monkeypatch):
+    state = State()
+    state.seed(0)
+    for _ in range(8):
+        state.raise_stack()
+    state.swap(5 * WIDTH + 2)
+    reference = state.clone()
+    native.drop_one(state)
+    assert native.clear_matches(state) == (0, 0)
+    monkeypatch.setattr(state_module, "_native", None)
+    reference.drop_one()
+    reference.clear_matches()
+    assert_same(state, reference)
+
+
+def test_swap_off_screen():
+    state = State()
+    with pytest.raises(ValueError):
+        native.swap(state, WIDTH - 1)
+    with pytest.raises(ValueError):
+        native.step(state, WIDTH * state.height)
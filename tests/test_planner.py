@@ -0,0 +1,70 @@
+import pytest
+
+from gym_paneldepon import planner
+from gym_paneldepon.bitboard import WIDTH
+from gym_paneldepon.state import ACTIONS, State
+
+_ = None
+R = 0
+G = 1
+Y = 2
+B = 3
+P = 4
+C = 5
+
+
+def replay(state, actions):
+    state = state.clone()
+    state.scoring_method = "endless"
+    total = 0
+    for action in actions:
+        total += state.step(ACTIONS[action])
+    for _ in range(state.height):
+        total += state.step(None)
+    return total
+
+
+@pytest.fixture
+def chain_state():
+    stack = [
+        G, _, _, _, _, _,
+        R, _, _, _, Y, P,
+        R, B, B, Y, P, C,
+        R, G, G, B, Y, P,
+    ]
+    return State.from_list(stack)
+
+
+@pytest.mark.parametrize("search", [planner.beam_search, planner.best_first_search])
+@pytest.mark.parametrize("heuristic", [planner.chaining_mass, planner.pending_chain, planner.match_potential])
+def test_finds_chain(search, heuristic, chain_state):
+    plan = search(chain_state, heuristic=heuristic, depth=8, max_nodes=5000)
+    assert plan.score >= 3
+    assert replay(chain_state, plan.actions) >= plan.score
+
+
+def test_budget(chain_state):
+    plan = planner.beam_search(chain_state, depth=50, max_nodes=100)
+    assert len(plan.actions) <= 50
+    plan = planner.best_first_search(chain_state, depth=50, time_limit=0)
+    assert plan.actions == []
+    assert plan.score == 0
+
+
+def test_reuses_children(chain_state):
+    chain_state.scoring_method = "endless"
+    node = planner.Node(chain_state)
+    children = node.expand()
+    assert node.expand() is children
+    mask = chain_state.get_action_mask()
+    assert len(children) == mask.sum() - mask[1]
+    assert [child.action for child in children[:2]] == [0, 2]
+    assert children[1].actions == [2]
+    # Swapping the two greens of the bottom row holds them in place so it is searched too
+    assert 2 + 3 * (WIDTH - 1) + 1 in [child.action for child in children]
+
+
+def test_heuristics(chain_state):
+    assert planner.chaining_mass(chain_state) == 0
+    assert planner.pending_chain(chain_state) == 3
+    assert planner.match_potential(chain_state) > 0
@@ -0,0 +1,58 @@
+from __future__ import unicode_literals
+
+from six import StringIO
+
+from gym_paneldepon.batch import BatchState
+from gym_paneldepon.render import FrameDiffer, render_batch, render_frame
+from gym_paneldepon.state import State
+
+
+def raised_state(seed, rows=4):
+    state = State(height=6, num_colors=4)
+    state.seed(seed)
+    for _ in range(rows):
+        state.raise_stack()
+    return state
+
+
+def test_frame():
+    state = raised_state(0)
+    state.swapping = 1
+    state.falling = state.colors[0]
+    state.chaining = state.colors[1]
+    frame = render_frame(state)
+    assert frame.endswith("chain=0\n")
+    assert frame.startswith("\u2015 \x1b[0m\u00b7 \x1b[0m")
+    assert "\x1b[32;1m" in frame
+    outfile = StringIO()
+    state.render(outfile)
+    assert outfile.getvalue() == frame
+
+
+def test_diff():
+    state = raised_state(1)
+    differ = FrameDiffer()
+    assert differ.diff(state) == render_frame(state)
+    unchanged = differ.diff(state)
+    assert unchanged == "\x1b[7A\x1b[6B\rchain=0\x1b[K\n"
+    state.colors[0] ^= 1 << 34
+    state.colors[1] &= ~(1 << 34)
+    state.colors[2] &= ~(1 << 34)
+    state.colors[3] &= ~(1 << 34)
+    changed = differ.diff(state)
+    assert changed.startswith("\x1b[7A\x1b[5B\x1b[9G")
+    assert changed.count("\x1b[0m") == 1
+
+
+def test_batch():
+    states = [raised_state(i) for i in range(3)]
+    states[2].chain_number = 2
+    frame = render_batch(states, columns=2, separator="|")
+    bands = frame.split("\n\n")
+    assert len(bands) == 2
+    lines = bands[0].splitlines()
+    assert len(lines) == 7
+    assert lines[0] == "|".join(render_frame(state).splitlines()[0] for state in states[:2])
+    assert lines[-1] == "chain=0     |chain=0"
+    assert bands[1].splitlines()[-1] == "chain=2"
+    assert render_batch(BatchState.from_states(states), columns=2, separator="|") == frame
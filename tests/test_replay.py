@@ -0,0 +1,82 @@
+import numpy as np
+
+from gym_paneldepon.bitboard import FULL
+from gym_paneldepon.env import PdPEndlessEnv
+from gym_paneldepon.replay import NO_ACTION, EpisodeLog, Recorder, ReplayReader, pack_halves, unpack_halves
+from gym_paneldepon.state import ACTIONS, State
+
+
+def make_env():
+    return PdPEndlessEnv(height=4, num_colors=3, max_chain=8)
+
+
+def test_pack_halves():
+    state = State()
+    state.colors[0] = FULL
+    state.chaining = 1 << 71
+    state.falling = 1 << 35 | 1 << 36
+    halves = state.encode_packed()
+    data = pack_halves(halves, np.zeros(halves.shape[:1] + (9,), dtype="u1"))
+    assert list(data[0]) == [255] * 9
+    np.testing.assert_array_equal(unpack_halves(data), halves)
+
+
+def test_recorder(tmpdir):
+    path = str(tmpdir.join("episodes.pdp"))
+    env = Recorder(make_env(), path, buffer_size=7)
+    env.seed(3)
+    observations = []
+    actions = []
+    rewards = []
+    for episode in range(2):
+        chain_number, observation = env.reset()
+        for t in range(20):
+            observations.append(observation.copy())
+            actions.append(env.action_space.sample())
+            (chain_number, observation), reward, done, _ = env.step(actions[-1])
+            rewards.append(reward)
+        final_state = env.unwrapped.state.clone()
+    env.close()
+
+    reader = ReplayReader(path)
+    assert reader.num_episodes == 2
+    assert len(reader) == 42
+    last = reader.episode(1)
+    assert last["action"][-1] == NO_ACTION
+    assert reader.get_state(len(reader) - 1) == final_state
+    steps = np.flatnonzero(reader.records["action"] != NO_ACTION)
+    batch = reader.batch(steps)
+    np.testing.assert_array_equal(batch.observations, observations)
+    np.testing.assert_array_equal(batch.actions, actions)
+    np.testing.assert_array_equal(batch.rewards, rewards)
+    _, packed = reader.observations(steps[:3], encoding="packed")
+    assert packed.dtype == np.uint64
+
+    # Appending continues the file
+    env = Recorder(make_env(), path)
+    env.reset()
+    env.step(0)
+    env.close()
+    reader = ReplayReader(path)
+    assert reader.num_episodes == 3
+    assert list(reader.episodes[-1]) == [42, 2]
+
+
+def test_episode_log():
+    state = State(scoring_method="endless")
+    log = EpisodeLog(state, keyframe_interval=7)
+    np_random = np.random.RandomState(0)
+    states = [state.clone()]
+    for _ in range(30):
+        action = np_random.randint(0, len(ACTIONS))
+        state.step(ACTIONS[action])
+        log.append(action, state)
+        states.append(state.clone())
+    assert len(log.keyframes) == 5
+    log = EpisodeLog.from_bytes(log.to_bytes())
+    for step in (0, 6, 7, 22, 30):
+        assert log.seek(step) == states[step]
+    forked = log.seek(30)
+    forked.step(ACTIONS[1])
+    state.step(ACTIONS[1])
+    assert forked == state
@@ -0,0 +1,31 @@
+import numpy as np
+
+from gym_paneldepon.rollout import RolloutService, episode_seed, random_policy
+from gym_paneldepon.state import ACTIONS, State
+
+
+def test_replay():
+    with RolloutService(3, episode_length=50, num_workers=0, height=8, num_colors=4) as service:
+        actions, rewards, observations = service.run(seed=7)
+    for episode in range(3):
+        state = State(scoring_method="endless", height=8, num_colors=4)
+        state.seed(episode_seed(7, episode))
+        for _ in range(6):
+            state.raise_stack()
+        for t in range(50):
+            np.testing.assert_array_equal(observations[episode, t], state.encode_packed())
+            assert actions[episode, t] == random_policy(state)
+            assert rewards[episode, t] == state.step(ACTIONS[actions[episode, t]])
+        np.testing.assert_array_equal(observations[episode, -1], state.encode_packed())
+
+
+def test_pool_matches_serial():
+    with RolloutService(5, episode_length=30, num_workers=0) as service:
+        serial = [array.copy() for array in service.run(seed=3)]
+    with RolloutService(5, episode_length=30, num_workers=2, chunk_size=2) as service:
+        chunks = list(service.stream(seed=3))
+        parallel = service.rollouts
+        assert sum(len(chunk.actions) for chunk in chunks) == 5
+        for expected, array in zip(serial, parallel):
+            np.testing.assert_array_equal(expected, array)
+    assert (serial[0] == 1).any()
@@ -0,0 +1,61 @@
+import itertools
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from gym_paneldepon import rows
+from gym_paneldepon.bitboard import WIDTH
+from gym_paneldepon.state import State
+
+
+def valid_rows(forbidden, num_colors):
+    result = []
+    for row in itertools.product(range(num_colors), repeat=WIDTH):
+        if any(color == forbidden[j] for j, color in enumerate(row)):
+            continue
+        if any(row[j] == row[j + 1] == row[j + 2] for j in range(WIDTH - 2)):
+            continue
+        result.append(row)
+    return result
+
+
+@pytest.mark.parametrize("forbidden,num_colors", [
+    ([-1] * WIDTH, 3),
+    ([0, 1, -1, 2, 2, -1], 3),
+    ([1, -1, -1, 0, -1, 1], 2),
+    ([-1, 3, 4, -1, 5, 0], 6),
+])
+def test_count_completions(forbidden, num_colors):
+    completions = rows.count_completions(forbidden, num_colors)
+    total = sum(completions[1][color][1] for color in range(num_colors) if color != forbidden[0])
+    assert total == len(valid_rows(forbidden, num_colors))
+
+
+def test_uniform():
+    forbidden = [0, -1, -1, 2, -1, -1]
+    expected = valid_rows(forbidden, 3)
+    np_random = np.random.RandomState(0)
+    draws = 200 * len(expected)
+    counts = Counter(tuple(rows.sample_row(np_random, forbidden, 3)) for _ in range(draws))
+    batch_counts = Counter(map(tuple, rows.sample_rows(np_random, [forbidden] * draws, 3)))
+    for result in (counts, batch_counts):
+        assert set(result) == set(expected)
+        assert max(result.values()) < 2 * min(result.values())
+
+
+def test_no_valid_rows():
+    with pytest.raises(ValueError):
+        rows.sample_row(np.random.RandomState(0), [-1] * WIDTH, 1)
+    with pytest.raises(ValueError):
+        rows.sample_rows(np.random.RandomState(0), [[-1] * WIDTH], 1)
+
+
+@pytest.mark.parametrize("height,num_colors", [(12, 6), (4, 3), (5, 2)])
+def test_raise_without_matches(height, num_colors):
+    for seed in range(20):
+        state = State(height=height, num_colors=num_colors)
+        state.seed(seed)
+        for _ in range(height):
+            state.raise_stack()
+            assert state.clone().clear_matches() == (0, 0)
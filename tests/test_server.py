@@ -0,0 +1,162 @@
+import asyncio
+
+import pytest
+
+from gym_paneldepon.client import Client
+from gym_paneldepon.env import PdPEndlessEnv
+from gym_paneldepon.protocol import ServerError
+from gym_paneldepon.server import EnvServer, LocalClient
+
+ACTIONS = [1, 1, 1, 1, 10, 11, 0, 20, 5, 1, 17, 3]
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_step_matches_state():
+    server = EnvServer(max_envs=4, height=4, num_colors=3, max_chain=8, seed=0)
+    client = LocalClient(server)
+
+    async def play():
+        env_id = await client.create()
+        chain_number, observation = await client.reset(env_id)
+        assert chain_number == 0
+        assert not observation.any()
+        results = []
+        for action in ACTIONS:
+            start = server.boards.get_state(env_id)
+            results.append((start, action, await client.step(env_id, action)))
+        return results
+
+    for start, action, ((chain_number, observation), reward) in run(play()):
+        if action == 1:
+            # Raising the stack draws random rows
+            continue
+        env = PdPEndlessEnv(height=4, num_colors=3, max_chain=8, encoding="packed")
+        env.state = start
+        (expected_chain, expected_observation), expected_reward, _, _ = env.step(action)
+        assert chain_number == expected_chain
+        assert reward == expected_reward
+        assert (observation == expected_observation).all()
+
+
+def test_concurrent_steps_are_batched():
+    server = EnvServer(max_envs=8, height=4, num_colors=3, seed=1)
+    client = LocalClient(server)
+
+    async def play():
+        env_ids = [await client.create() for _ in range(8)]
+        for _ in range(4):
+            await asyncio.gather(*[client.step(env_id, 1) for env_id in env_ids])
+        # Repeated steps of one environment are applied in order in separate batches
+        await asyncio.gather(client.step(env_ids[0], 10), client.step(env_ids[0], 10))
+        return env_ids
+
+    env_ids = run(play())
+    assert server.num_steps == 34
+    assert server.num_batches == 6
+    assert len(set(server.boards.get_state(env_id).key for env_id in env_ids)) > 1
+
+
+def test_tree_and_errors():
+    server = EnvServer(max_envs=1, seed=2)
+    client = LocalClient(server)
+
+    async def play():
+        env_id = await client.create()
+        with pytest.raises(ServerError):
+            await client.create()
+        for _ in range(6):
+            await client.step(env_id, 1)
+        chain_numbers, observations, rewards, mask = await client.get_tree(env_id)
+        env = PdPEndlessEnv(encoding="packed")
+        env.state = server.boards.get_state(env_id)
+        expected = env.get_tree_batch()
+        # The child of raising the stack draws a random row
+        assert (chain_numbers[2:] == expected.chain_numbers[2:]).all()
+        assert (observations[2:] == expected.observations[2:]).all()
+        assert (rewards[2:] == expected.rewards[2:]).all()
+        assert (observations[0] == expected.observations[0]).all()
+        assert (mask == expected.mask).all()
+        with pytest.raises(ServerError):
+            await client.step(env_id, client.num_actions)
+        await client.close_env(env_id)
+        with pytest.raises(ServerError):
+            await client.step(env_id, 0)
+        assert await client.create() == env_id
+
+    run(play())
+
+
+@pytest.mark.skipif(not hasattr(asyncio, "start_unix_server"), reason="Unix sockets are not available")
+def test_unix_socket(tmpdir):
+    path = str(tmpdir.join("server.sock"))
+    server = EnvServer(max_envs=4, height=4, num_colors=3, seed=3)
+
+    async def play():
+        listener = await server.start(path=path)
+        clients = [await Client.connect(path=path) for _ in range(2)]
+        env_ids = [await client.create() for client in clients]
+        for _ in range(4):
+            await asyncio.gather(*[client.step(env_id, 1) for client, env_id in zip(clients, env_ids)])
+        results = await asyncio.gather(*[client.step(env_id, 10) for client, env_id in zip(clients, env_ids)])
+        for client in clients:
+            await client.close()
+        listener.close()
+        await listener.wait_closed()
+        return env_ids, results
+
+    env_ids, results = run(play())
+    assert server.num_batches == 5
+    for env_id, ((chain_number, observation), _reward) in zip(env_ids, results):
+        assert chain_number == server.boards.chain_number[env_id]
+        assert (observation == server.boards.get_state(env_id).encode_packed()).all()
+
+
+def test_requests_of_an_environment_run_in_order():
+    server = EnvServer(max_envs=4, height=4, num_colors=3, seed=4)
+    client = LocalClient(server)
+
+    async def play():
+        env_id = await client.create()
+        # The tree is taken after the step and the reset after both
+        step, tree, reset = await asyncio.gather(
+            client.step(env_id, 1), client.get_tree(env_id), client.reset(env_id)
+        )
+        (_, observation), _ = step
+        _, observations, _, _ = tree
+        assert observation.any()
+        assert (observations[0] == observation).all()
+        assert not reset[1].any()
+        # A closed environment isn't handed out again before its queued step has run
+        _, _, new_id = await asyncio.gather(client.step(env_id, 1), client.close_env(env_id), client.create())
+        assert new_id != env_id
+        assert set(server.boards.get_state(new_id).to_list()) == {None}
+        with pytest.raises(ServerError):
+            await asyncio.gather(client.close_env(new_id), client.step(new_id, 1))
+
+    run(play())
+    assert not server.queues
+
+
+def test_unexpected_errors_are_reported():
+    server = EnvServer(max_envs=1, height=4, num_colors=3)
+    client = LocalClient(server)
+
+    def broken(env_id):
+        raise RuntimeError("Broken")
+
+    server.get_tree = broken
+
+    async def play():
+        env_id = await client.create()
+        with pytest.raises(ServerError, match="Broken"):
+            await client.get_tree(env_id)
+        await client.step(env_id, 0)
+
+    run(play())
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from gym_paneldepon.profiling import Profiler
+from gym_paneldepon.sliced import SlicedState, num_slices, split_colors
+from gym_paneldepon.state import ACTIONS, RAISE_STACK, State
+
+_ = None
+R = 0
+G = 1
+Y = 2
+B = 3
+P = 4
+C = 5
+
+
+def test_slices():
+    assert [num_slices(n) for n in range(1, 9)] == [1, 1, 2, 2, 3, 3, 3, 3]
+    masks = split_colors(0b1111, [0b1010, 0b1100])
+    assert masks == [0b0001, 0b0010, 0b0100, 0b1000]
+
+
+def test_list_roundtrip():
+    stack = [
+        G, _, _, _, _, _,
+        R, _, _, _, Y, P,
+        R, B, B, Y, P, C,
+        R, G, G, B, Y, P,
+    ]
+    state = SlicedState.from_list(stack)
+    assert state.to_list() == stack
+    assert len(state.slices) == 3
+    assert state.colors == State.from_list(stack).colors
+    assert state.to_state() == State.from_list(stack)
+
+
+@pytest.mark.parametrize("height,num_colors", [(4, 3), (8, 5), (12, 6)])
+def test_matches_state(height, num_colors):
+    np_random = np.random.RandomState(height)
+    state = State(scoring_method="endless", height=height, num_colors=num_colors)
+    state.seed(num_colors)
+    sliced = SlicedState.from_state(state)
+    sliced.seed(num_colors)
+    for _ in range(500):
+        if np_random.rand() < 0.2:
+            action = RAISE_STACK
+        else:
+            action = ACTIONS[np_random.randint(0, 2 + 5 * height)]
+        assert sliced.step(action) == state.step(action)
+        assert sliced == state
+    assert (sliced.encode() == state.encode()).all()
+    assert (sliced.encode_packed() == state.encode_packed()).all()
+    assert (sliced.get_action_mask() == state.get_action_mask()).all()
+
+
+def test_clone_and_serialize():
+    state = SlicedState(height=6, num_colors=4)
+    state.seed(0)
+    for _ in range(4):
+        state.step(RAISE_STACK)
+    clone = state.clone()
+    clone.step(RAISE_STACK)
+    assert clone != state
+    copy = SlicedState.deserialize(state.serialize())
+    assert isinstance(copy, SlicedState)
+    assert copy == state
+    assert copy.step(RAISE_STACK) == state.step(RAISE_STACK)
+    assert copy == state
+
+
+def test_profiled_step():
+    state = SlicedState(height=4, num_colors=3)
+    state.profiler = Profiler()
+    for _ in range(3):
+        state.step(RAISE_STACK)
+    state.step(2)
+    assert state.profiler.steps == 4
+    assert state.profiler.calls["raise_stack"] == 3
@@ -1,7 +1,10 @@
+import numpy as np
 import pytest
 
+from gym_paneldepon import state as state_module
 from gym_paneldepon.bitboard import FULL, WIDTH
-from gym_paneldepon.state import RAISE_STACK, State
+from gym_paneldepon.profiling import Profiler
+from gym_paneldepon.state import ACTIONS, RAISE_STACK, State
 
 _ = None
 R = 0
@@ -13,6 +16,15 @@ C = 5
 W = 6
 
 
+@pytest.fixture(autouse=True, params=["native", "python"])
+def implementation(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(state_module, "_native", None)
+    elif state_module._native is None:
+        pytest.skip("Native extension not built")
+    return request.param
+
+
 def test_raise_stack():
     state = State()
     for i in range(state.height):
@@ -337,3 +349,179 @@ def test_clone():
     assert clone.scoring_method == state.scoring_method
     assert clone.height == state.height
     assert clone.num_colors == state.num_colors
+
+
+def test_key():
+    state = State(height=7, num_colors=5)
+    for i in range(5):
+        state.raise_stack()
+    clone = state.clone()
+    assert clone == state
+    assert hash(clone) == hash(state)
+    assert len(set([clone, state])) == 1
+    clone.step(None)
+    clone.step(3 * WIDTH + 2)
+    assert clone != state
+    assert clone.key != state.key
+    assert State(height=7) != State(height=8)
+    assert State(num_colors=5) != State(num_colors=6)
+
+
+def test_lazy_random():
+    state = State()
+    assert not hasattr(state, "__dict__")
+    state.seed(1)
+    clone = state.clone()
+    assert clone._np_random is None
+    clone.raise_stack()
+    assert clone._np_random is not None
+    assert clone.np_random is not state.np_random
+    other = State()
+    other.seed(1)
+    state.raise_stack()
+    other.raise_stack()
+    assert state == other
+
+
+def test_action_mask():
+    stack = [
+        _, _, _, _, _, _,
+        R, R, _, _, _, _,
+        G, R, R, B, B, G,
+    ]
+    state = State.from_list(stack)
+    mask = state.get_action_mask()
+    assert len(mask) == 2 + (WIDTH - 1) * state.height
+    assert list(mask[:2]) == [True, True]
+    assert not mask[2:2 + WIDTH - 1].any()
+    assert list(mask[2 + WIDTH - 1:2 + 2 * (WIDTH - 1)]) == [True, True, False, False, False]
+    assert mask[2 + 2 * (WIDTH - 1):].all()
+
+
+def test_action_mask_blocked():
+    stack = [
+        R, _, G, B, _, _,
+        G, _, B, Y, _, _,
+    ]
+    state = State.from_list(stack)
+    state.step(0)
+    assert state.swapping
+    mask = state.get_action_mask()
+    assert list(mask[2:2 + WIDTH - 1]) == [False, False, True, True, False]
+
+
+def test_action_mask_equivalence():
+    np_random = np.random.RandomState(0)
+    num_masked = 0
+    for seed in range(200):
+        state = State(height=8, num_colors=4)
+        state.seed(seed)
+        for _ in range(np_random.randint(1, 9)):
+            state.raise_stack()
+        for _ in range(np_random.randint(0, 20)):
+            state.step(ACTIONS[np_random.randint(0, len(state.get_action_mask()))])
+        reference = state.clone()
+        reference.step(None)
+        mask = state.get_action_mask()
+        for action, (child, _score) in enumerate(state.get_children()):
+            if not mask[action]:
+                num_masked += 1
+                assert child.key == reference.key
+    assert num_masked > 100
+
+
+def assert_masked_actions_do_nothing(state):
+    reference = state.clone()
+    reference.step(None)
+    mask = state.get_action_mask()
+    for action, (child, _score) in enumerate(state.get_children()):
+        if not mask[action]:
+            assert child.key == reference.key
+    return mask
+
+
+def test_action_mask_raise_falling_top():
+    stack = [
+        R, _, _, _, _, _,
+        _, _, _, _, _, _,
+        G, B, B, Y, _, _,
+        B, G, G, R, R, _,
+    ]
+    state = State.from_list(stack)
+    state.seed(0)
+    mask = assert_masked_actions_do_nothing(state)
+    assert mask[1]
+    child = state.clone()
+    child.step(RAISE_STACK)
+    reference = state.clone()
+    reference.step(None)
+    assert child.key != reference.key
+
+
+def test_action_mask_raise_clearing_top():
+    stack = [
+        R, R, R, _, _, _,
+        G, B, Y, _, _, _,
+        B, G, G, Y, _, _,
+        Y, B, B, G, _, _,
+    ]
+    state = State.from_list(stack)
+    state.seed(0)
+    assert assert_masked_actions_do_nothing(state)[1]
+    # A resting top row panel that doesn't match blocks the raise
+    stack[3] = G
+    stack[WIDTH + 3] = B
+    state = State.from_list(stack)
+    state.seed(0)
+    assert not assert_masked_actions_do_nothing(state)[1]
+
+
+def test_settled_drop():
+    state = State()
+    state.seed(2)
+    for i in range(6):
+        state.raise_stack()
+    state.falling = 1 << (WIDTH * (state.height - 1))
+    settled = state.clone()
+    state.drop_one()
+    assert state.falling == 0
+    assert state.colors == settled.colors
+
+
+def test_serialize():
+    state = State(scoring_method="endless", height=8, num_colors=5)
+    assert State.deserialize(state.serialize()) == state
+    state.seed(4)
+    for _ in range(4):
+        state.raise_stack()
+    state.step(10)
+    state.chaining = 1 << 71
+    clone = State.deserialize(state.serialize())
+    assert clone == state
+    assert clone.scoring_method == "endless"
+    for _ in range(3):
+        state.raise_stack()
+        clone.raise_stack()
+    assert clone == state
+
+
+def test_profiler():
+    state = State(scoring_method="endless")
+    state.seed(5)
+    reference = state.clone()
+    reference.seed(5)
+    profiler = state.profiler = Profiler()
+    for _ in range(14):
+        assert state.step(RAISE_STACK) == reference.step(RAISE_STACK)
+    for action in ACTIONS[2:30]:
+        assert state.step(action) == reference.step(action)
+    assert state == reference
+    assert state.clone().profiler is profiler
+    assert reference.profiler is None
+    profile = profiler.as_dict()
+    assert profile["steps"] == 42
+    assert profile["clones"] == 1
+    assert profile["raises_blocked"] == 2
+    assert profile["phases"]["raise_stack"]["calls"] == 14
+    assert profile["phases"]["swap"]["calls"] == 42
+    assert profile["phases"]["drop_one"]["seconds"] > 0